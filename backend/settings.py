@@ -46,6 +46,34 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'main.urls'
 
+AUTHENTICATION_BACKENDS = [
+    'main.auth_backend.AuthUserBackend',
+]
+
+# Sessions are read on every request, keep them in the cache in front of the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+
+# Process-local caches, which assume a single server process (see start.sh and main/cache.py).
+# Sessions get their own cache so that culling app data never evicts sessions, and the other way around.
+CACHES = {
+    # Users, friend lists and friend group lists, see main/cache.py
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'nova210se-data',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'nova210se-sessions',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
 ASGI_APPLICATION = 'backend.asgi.application'
 
 DATABASES = {
@@ -0,0 +1,38 @@
+"""
+Authentication backend loading only the AuthUser columns needed to authenticate and to keep a session
+"""
+
+from django.contrib.auth.backends import ModelBackend
+
+from main.models import AuthUser
+
+# Columns used by password checks, session hashes and is_active checks, the rest are loaded on access
+AUTH_USER_FIELDS = ("id", "password", "is_active", "username")
+
+
+class AuthUserBackend(ModelBackend):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        # Same as ModelBackend, the user name may also be passed by the name of the USERNAME_FIELD
+        if username is None:
+            username = kwargs.get(AuthUser.USERNAME_FIELD)
+
+        if username is None or password is None:
+            return None
+
+        auth_user = AuthUser.objects.only(*AUTH_USER_FIELDS).filter(**{AuthUser.USERNAME_FIELD: username}).first()
+        if auth_user is None:
+            # Run the default password hasher once to reduce the timing difference with an existing user
+            AuthUser().set_password(password)
+            return None
+
+        if auth_user.check_password(password) and self.user_can_authenticate(auth_user):
+            return auth_user
+
+        return None
+
+    def get_user(self, user_id):
+        auth_user = AuthUser.objects.only(*AUTH_USER_FIELDS).filter(pk=user_id).first()
+        if auth_user is None or not self.user_can_authenticate(auth_user):
+            return None
+
+        return auth_user
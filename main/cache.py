@@ -0,0 +1,131 @@
+"""
+Cross-request caches for frequently read models, backed by the django cache framework.
+
+Cached entries are invalidated by model signals, see the receivers below.
+
+The cache is the process-local "default" cache (see CACHES in settings), and the signals only invalidate entries in
+the process that changed the model. This is correct as long as the server runs a single process, as start.sh does;
+running several processes requires a shared cache backend such as redis or memcached.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from main.models import User, AuthUser, Friend, FriendGroup
+
+USER_CACHE_TIMEOUT = 300
+LIST_CACHE_TIMEOUT = 300
+
+
+def _user_key(auth_user_id: int) -> str:
+    return f"user_by_auth_user_{auth_user_id}"
+
+
+def get_user_by_auth_user(auth_user: AuthUser) -> User:
+    """
+    Get the User of an AuthUser, together with its auth_user and default_group, from cache if possible.
+
+    The default group is never renamed or deleted while the user exists, so it is not tracked for invalidation.
+
+    Raises User.DoesNotExist if there is no such user.
+    """
+
+    key = _user_key(auth_user.id)
+    user: User | None = cache.get(key)
+
+    if user is None:
+        user = User.objects.select_related("auth_user", "default_group").get(auth_user=auth_user)
+        cache.set(key, user, USER_CACHE_TIMEOUT)
+
+    return user
+
+
+def invalidate_user(auth_user_id: int):
+    cache.delete(_user_key(auth_user_id))
+
+
+def _friend_list_key(user_id: int) -> str:
+    return f"friend_list_{user_id}"
+
+
+def _group_list_key(user_id: int) -> str:
+    return f"group_list_{user_id}"
+
+
+def _get_or_load(key: str, loader) -> any:
+    value = cache.get(key)
+
+    if value is None:
+        value = loader()
+        cache.set(key, value, LIST_CACHE_TIMEOUT)
+
+    return value
+
+
+def get_friend_list(user_id: int, loader) -> list:
+    """
+    Get the serialized friend list of a user from cache, or from the loader on a miss.
+    """
+
+    return _get_or_load(_friend_list_key(user_id), loader)
+
+
+def get_group_list(user_id: int, loader) -> list:
+    """
+    Get the serialized friend group list of a user from cache, or from the loader on a miss.
+    """
+
+    return _get_or_load(_group_list_key(user_id), loader)
+
+
+def invalidate_friend_lists(*user_ids: int):
+    """
+    Invalidate friend lists of the given users, now and when the current transaction commits; signals cover most
+    changes, but this must be called after bulk_create / update of Friend rows.
+    """
+
+    _delete_now_and_on_commit([_friend_list_key(user_id) for user_id in user_ids])
+
+
+def _delete_now_and_on_commit(keys: list[str]):
+    """
+    Delete cache entries now, and again when the current transaction commits (immediately outside a transaction).
+
+    A request that reads the rows before the commit still sees the old values and may cache them again, the second
+    delete drops those entries.
+    """
+
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+# The receivers below only clear the cache of the current process, which is enough for a single server process
+@receiver([post_save, post_delete], sender=AuthUser)
+def _on_auth_user_changed(instance: AuthUser, update_fields: frozenset | None = None, **kwargs):
+    keys = [_user_key(instance.id)]
+
+    # The user name is part of the friend lists of the user's friends
+    if update_fields is None or "username" in update_fields:
+        keys += [_friend_list_key(user_id) for user_id in
+                 Friend.objects.filter(friend__auth_user_id=instance.id).values_list("user_id", flat=True)]
+
+    _delete_now_and_on_commit(keys)
+
+
+@receiver([post_save, post_delete], sender=User)
+def _on_user_changed(instance: User, **kwargs):
+    # The user's profile is part of the friend lists of its friends
+    user_ids = [instance.id, *Friend.objects.filter(friend=instance).values_list("user_id", flat=True)]
+    _delete_now_and_on_commit([_user_key(instance.auth_user_id), *map(_friend_list_key, user_ids)])
+
+
+@receiver([post_save, post_delete], sender=Friend)
+def _on_friend_changed(instance: Friend, **kwargs):
+    _delete_now_and_on_commit([_friend_list_key(instance.user_id)])
+
+
+@receiver([post_save, post_delete], sender=FriendGroup)
+def _on_friend_group_changed(instance: FriendGroup, **kwargs):
+    # Group names are part of the friend list, and friends of a deleted group are moved by an update
+    _delete_now_and_on_commit([_group_list_key(instance.user_id), _friend_list_key(instance.user_id)])
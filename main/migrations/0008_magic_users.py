@@ -0,0 +1,31 @@
+from django.contrib.auth.hashers import make_password
+from django.db import migrations
+
+
+def create_magic_users(apps, schema_editor):
+    """
+    Create magic users #SYSTEM and #DELETED, so that they exist for the whole lifetime of the database
+    """
+
+    AuthUser = apps.get_model("auth", "User")
+    User = apps.get_model("main", "User")
+
+    for username in ["#SYSTEM", "#DELETED"]:
+        auth_user, _ = AuthUser.objects.get_or_create(username=username, defaults={"password": make_password(None)})
+        User.objects.get_or_create(auth_user=auth_user, defaults={
+            "avatar_url": "",
+            "email": "",
+            "phone": "",
+            "system": True,
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_chatmessage_deleted_users'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_magic_users, migrations.RunPython.noop),
+    ]
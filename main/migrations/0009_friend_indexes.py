@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-16 13:03
+
+from django.db import migrations, models
+
+
+def delete_duplicate_invitations(apps, schema_editor):
+    """
+    Keep only the latest invitation between each sender and receiver, so that the unique constraint can be created
+    """
+
+    FriendInvitation = apps.get_model("main", "FriendInvitation")
+    seen = set()
+    for invitation in FriendInvitation.objects.order_by("-id").only("id", "sender_id", "receiver_id"):
+        key = (invitation.sender_id, invitation.receiver_id)
+        if key in seen:
+            invitation.delete()
+        seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_magic_users'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='friend',
+            index=models.Index(fields=['user', 'friend'], name='friend_user_friend_idx'),
+        ),
+        migrations.RunPython(delete_duplicate_invitations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='friendinvitation',
+            constraint=models.UniqueConstraint(fields=('sender', 'receiver'), name='unique_friend_invitation'),
+        ),
+    ]
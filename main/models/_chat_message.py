@@ -27,15 +27,34 @@ class ChatMessage(models.Model):
 
     deleted_users = models.ManyToManyField(User, related_name="chat_message_deleted_users")
 
+    @staticmethod
+    def with_struct_relations(messages: models.QuerySet) -> models.QuerySet:
+        """
+        Load everything to_detailed_struct reads in a fixed number of queries for the whole queryset, instead of
+        a few queries per message
+        """
+
+        deleted_users = models.Prefetch("deleted_users", queryset=User.objects.only("id"))
+        replies = ChatMessage.objects.select_related("sender__auth_user").prefetch_related(deleted_users) \
+            .order_by("id")
+
+        return messages.select_related("sender__auth_user", "reply_to__sender__auth_user").prefetch_related(
+            models.Prefetch("read_users", queryset=User.objects.select_related("auth_user")),
+            deleted_users,
+            models.Prefetch("reply_to__deleted_users", queryset=User.objects.only("id")),
+            models.Prefetch("chat_message_reply_to", queryset=replies),
+        )
+
     def to_basic_struct(self, user: User):
         return {
             "message_id": self.id,
-            "chat_id": self.chat.id,
+            "chat_id": self.chat_id,
             "message": self.message,
             "send_time": self.send_time.timestamp(),
             "sender": self.sender.to_basic_struct(),
-            "reply_to_id": self.reply_to.id if self.reply_to is not None else None,
-            "deleted": self.deleted or user in self.deleted_users.all()
+            "reply_to_id": self.reply_to_id,
+            # Compare ids over all() so that prefetched deleted users are used
+            "deleted": self.deleted or any(u.id == user.id for u in self.deleted_users.all())
         }
 
     def to_detailed_struct(self, user: User):
@@ -45,5 +64,5 @@ class ChatMessage(models.Model):
 
             # Only basic struct is returned for reply_to to prevent infinite recursion
             "reply_to": self.reply_to.to_basic_struct(user) if self.reply_to is not None else None,
-            "replied_by": [m.to_basic_struct(user) for m in ChatMessage.objects.filter(reply_to=self)]
+            "replied_by": [m.to_basic_struct(user) for m in self.chat_message_reply_to.all()]
         }
@@ -43,9 +43,29 @@ class Friend(models.Model):
     """
     group = models.ForeignKey(FriendGroup, on_delete=models.RESTRICT, related_name="friend_friend_group")
 
+    class Meta:
+        # Friendships are looked up by both sides at once
+        indexes = [models.Index(fields=["user", "friend"], name="friend_user_friend_idx")]
+
     def to_struct(self):
         return {
             "friend": self.friend.to_detailed_struct(),
             "nickname": self.nickname,
             "group": self.group.to_struct()
         }
+
+    @staticmethod
+    def struct_fields() -> list[str]:
+        return ["nickname", *User.detailed_struct_fields("friend__"), *FriendGroup.struct_fields("group__")]
+
+    @staticmethod
+    def struct_from_row(row: dict) -> dict:
+        """
+        Same as to_struct, built from a values() row with the struct_fields, without model instances
+        """
+
+        return {
+            "friend": User.detailed_struct_from_row(row, "friend__"),
+            "nickname": row["nickname"],
+            "group": FriendGroup.struct_from_row(row, "group__")
+        }
@@ -53,3 +53,18 @@ class FriendGroup(models.Model):
             "group_id": self.id,
             "group_name": self.name
         }
+
+    @staticmethod
+    def struct_fields(prefix: str = "") -> list[str]:
+        return [f"{prefix}id", f"{prefix}name"]
+
+    @staticmethod
+    def struct_from_row(row: dict, prefix: str = "") -> dict:
+        """
+        Same as to_struct, built from a values() row with the struct_fields
+        """
+
+        return {
+            "group_id": row[f"{prefix}id"],
+            "group_name": row[f"{prefix}name"]
+        }
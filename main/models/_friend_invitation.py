@@ -42,6 +42,10 @@ class FriendInvitation(models.Model):
     """
     source = models.IntegerField()
 
+    class Meta:
+        # There is at most one pending invitation between a sender and a receiver, a new one replaces the old one
+        constraints = [models.UniqueConstraint(fields=["sender", "receiver"], name="unique_friend_invitation")]
+
     def to_struct(self):
         return {
             "id": self.id,
@@ -50,3 +54,22 @@ class FriendInvitation(models.Model):
             "comment": self.comment,
             "source": self.source if self.source >= 0 else "search",
         }
+
+    @staticmethod
+    def struct_fields() -> list[str]:
+        return ["id", *User.basic_struct_fields("sender__"), *User.basic_struct_fields("receiver__"), "comment",
+                "source"]
+
+    @staticmethod
+    def struct_from_row(row: dict) -> dict:
+        """
+        Same as to_struct, built from a values() row with the struct_fields, without model instances
+        """
+
+        return {
+            "id": row["id"],
+            "sender": User.basic_struct_from_row(row, "sender__"),
+            "receiver": User.basic_struct_from_row(row, "receiver__"),
+            "comment": row["comment"],
+            "source": row["source"] if row["source"] >= 0 else "search",
+        }
@@ -1,3 +1,4 @@
+import functools
 import re
 
 from django.db import models
@@ -7,6 +8,9 @@ from main.exceptions import FieldMissingError, FieldTypeError, ClientSideError
 
 EMAIL_REGEX = re.compile(r"^[a-zA-Z0-9_.+-]+@([A-Za-z0-9-]+\.)+[A-Za-z0-9-]+$")
 DATA_URL_REGEX = re.compile(r"^data:image/[a-zA-Z]+;base64,[a-zA-Z0-9+/=]+$")
+USERNAME_REGEX = re.compile(r"[a-zA-Z0-9\-_()@.]+")
+HTTP_URL_REGEX = re.compile(r"https?://.+")
+PHONE_REGEX = re.compile(r"1[0-9]+")
 
 
 class User(models.Model):
@@ -34,7 +38,7 @@ class User(models.Model):
         if username == "":
             raise ClientSideError("Username cannot be empty")
 
-        if not re.match(r"^[a-zA-Z0-9\-_()@.]+$", username):
+        if USERNAME_REGEX.fullmatch(username) is None:
             raise ClientSideError("Only a-z A-Z 0-9 - _ ( ) @ . are allowed.")
 
         if not allow_conflict and AuthUser.objects.filter(username=username).exists():
@@ -88,7 +92,7 @@ class User(models.Model):
         if len(avatar_url) > 500:
             raise ClientSideError("Avatar URL cannot be longer than 500 characters")
 
-        if re.match(r"^https?://.+", avatar_url) is None:
+        if HTTP_URL_REGEX.match(avatar_url) is None:
             raise ClientSideError("Invalid avatar URL")
 
     # Allow this to be null so that there won't be an infinite loop when creating user
@@ -144,23 +148,37 @@ class User(models.Model):
         elif len(phone) < 11:
             raise ClientSideError("Phone number too short")
 
-        if re.match(r"^1[0-9]+$", phone) is None:
+        if PHONE_REGEX.fullmatch(phone) is None:
             raise ClientSideError("Invalid phone number format")
 
     system = models.BooleanField(default=False)
 
     @staticmethod
+    @functools.cache
     def magic_user_deleted():
+        """
+        Returns magic user #DELETED, which takes over the messages of deleted users and recalled messages.
+
+        The user is created by migration and never changes, so it is fetched only once per process.
+        """
+
         try:
-            return User.objects.get(auth_user__username="#DELETED")
+            return User.objects.select_related("auth_user").get(auth_user__username="#DELETED")
         except User.DoesNotExist:
             auth_user = AuthUser.objects.create_user(username="#DELETED", password="whatever")
             return User.objects.create(auth_user=auth_user, avatar_url="", email="", phone="", system=True)
 
     @staticmethod
+    @functools.cache
     def magic_user_system():
+        """
+        Returns magic user #SYSTEM, the sender of system messages.
+
+        The user is created by migration and never changes, so it is fetched only once per process.
+        """
+
         try:
-            return User.objects.get(auth_user__username="#SYSTEM")
+            return User.objects.select_related("auth_user").get(auth_user__username="#SYSTEM")
         except User.DoesNotExist:
             auth_user = AuthUser.objects.create_user(username="#SYSTEM", password="whatever")
             return User.objects.create(auth_user=auth_user, avatar_url="", email="", phone="", system=True)
@@ -189,3 +207,39 @@ class User(models.Model):
             "email": self.email,
             "phone": self.phone
         }
+
+    @staticmethod
+    def basic_struct_fields(prefix: str = "") -> list[str]:
+        """
+        Fields to read with values() for basic_struct_from_row, prefix is the relation path to the user, e.g. "sender__"
+        """
+
+        return [f"{prefix}id", f"{prefix}auth_user__username", f"{prefix}avatar_url"]
+
+    @staticmethod
+    def basic_struct_from_row(row: dict, prefix: str = "") -> dict:
+        """
+        Same as to_basic_struct, built from a values() row with the basic_struct_fields, without a model instance
+        """
+
+        return {
+            "id": row[f"{prefix}id"],
+            "user_name": row[f"{prefix}auth_user__username"],
+            "avatar_url": row[f"{prefix}avatar_url"]
+        }
+
+    @staticmethod
+    def detailed_struct_fields(prefix: str = "") -> list[str]:
+        return [*User.basic_struct_fields(prefix), f"{prefix}email", f"{prefix}phone"]
+
+    @staticmethod
+    def detailed_struct_from_row(row: dict, prefix: str = "") -> dict:
+        """
+        Same as to_detailed_struct, built from a values() row with the detailed_struct_fields
+        """
+
+        return {
+            **User.basic_struct_from_row(row, prefix),
+            "email": row[f"{prefix}email"],
+            "phone": row[f"{prefix}phone"]
+        }
@@ -2,11 +2,14 @@
 Unit tests for user-related APIs
 """
 
+from django.db import transaction
 from django.test import TestCase
 from django.urls import reverse
 
+from main.cache import get_friend_list, get_user_by_auth_user
 from main.models import User, AuthUser, FriendInvitation, Friend, FriendGroup
 from main.tests.utils import create_user, login_user, logout_user, JsonClient, get_user_by_name, create_friendship
+from main.views import friend
 
 
 class FriendControlTests(TestCase):
@@ -337,12 +340,19 @@ class FriendControlTests(TestCase):
         u2 = get_user_by_name("u2")
 
         self.send_invitation_via_search("u1", "u2")
+        _id1 = FriendInvitation.objects.get(sender=u1).id
         self.send_invitation_via_search("u1", "u2", ":(")
         _id2 = FriendInvitation.objects.get(sender=u1).id
         self.assertEqual(FriendInvitation.objects.filter(sender=u1).count(), 1)
         self.assertEqual(FriendInvitation.objects.filter(receiver=u2).count(), 1)
         self.assertEqual(FriendInvitation.objects.get(id=_id2).comment, ":(")
 
+        # The invitation is replaced in place, there is exactly one row for the pair
+        self.assertEqual(_id1, _id2)
+        self.send_invitation_via_search("u1", "u2", ":|")
+        self.assertEqual(FriendInvitation.objects.filter(sender=u1, receiver=u2).count(), 1)
+        self.assertEqual(FriendInvitation.objects.get(sender=u1, receiver=u2).comment, ":|")
+
     def test_receive_multiple_invitations(self):
         """
         Receive multiple invitations from other users
@@ -748,6 +758,100 @@ class FriendControlTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()["data"], [f1.to_struct(), f2.to_struct()])
 
+    def test_list_friend_after_changes(self):
+        """
+        The (cached) friend list reflects changes to friends, groups and friends' profiles
+        """
+
+        self.assertTrue(create_user(self.client, "ur"))
+        self.assertTrue(create_user(self.client, "u1"))
+        self.assertTrue(create_friendship(self.client, "ur", "u1"))
+        u1 = get_user_by_name("u1")
+
+        self.assertTrue(login_user(self.client, "ur"))
+        response = self.client.get(reverse("friend_list_friend"))
+        self.assertEqual(response.json()["data"][0]["nickname"], "")
+
+        # Move the friend to a new group with a nickname
+        response = self.client.post(reverse("friend_group_add"), {"group_name": "g1"})
+        group_id = response.json()["data"]["group_id"]
+        response = self.client.patch(reverse("friend_query", kwargs={"friend_user_id": u1.id}), {
+            "nickname": "nick",
+            "group_id": group_id,
+        })
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(reverse("friend_list_friend"))
+        self.assertEqual(response.json()["data"][0]["nickname"], "nick")
+        self.assertEqual(response.json()["data"][0]["group"], {"group_id": group_id, "group_name": "g1"})
+
+        # Rename the group
+        response = self.client.patch(reverse("friend_group_query", kwargs={"group_id": group_id}), {
+            "group_name": "g2"
+        })
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(reverse("friend_list_friend"))
+        self.assertEqual(response.json()["data"][0]["group"]["group_name"], "g2")
+
+        response = self.client.get(reverse("friend_group_list"))
+        self.assertIn({"group_id": group_id, "group_name": "g2"}, response.json()["data"])
+
+        # Delete the group, the friend is moved to the default group
+        response = self.client.delete(reverse("friend_group_query", kwargs={"group_id": group_id}))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(reverse("friend_list_friend"))
+        self.assertNotEqual(response.json()["data"][0]["group"]["group_id"], group_id)
+
+        response = self.client.get(reverse("friend_group_list"))
+        self.assertNotIn(group_id, [g["group_id"] for g in response.json()["data"]])
+
+        # The friend changes its avatar
+        self.assertTrue(logout_user(self.client))
+        self.assertTrue(login_user(self.client, "u1"))
+        avatar_url = "https://localhost:8000/avatar.jpg"
+        response = self.client.patch(reverse("user"), {"avatar_url": avatar_url})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertTrue(logout_user(self.client))
+        self.assertTrue(login_user(self.client, "ur"))
+        response = self.client.get(reverse("friend_list_friend"))
+        self.assertEqual(response.json()["data"][0]["friend"]["avatar_url"], avatar_url)
+
+        # The friend changes its name only, which is saved on the auth user
+        self.assertTrue(logout_user(self.client))
+        self.assertTrue(login_user(self.client, "u1"))
+        response = self.client.patch(reverse("user"), {"user_name": "u1_renamed"})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertTrue(logout_user(self.client))
+        self.assertTrue(login_user(self.client, "ur"))
+        response = self.client.get(reverse("friend_list_friend"))
+        self.assertEqual(response.json()["data"][0]["friend"]["user_name"], "u1_renamed")
+
+    def test_list_friend_cached_before_commit(self):
+        """
+        A friend list cached while a new friendship is not yet committed is dropped from the cache on commit
+        """
+
+        self.assertTrue(create_user(self.client, "ur"))
+        self.assertTrue(create_user(self.client, "u1"))
+        self.send_invitation_via_search("u1", "ur")
+        ur = get_user_by_name("ur")
+        invitation = FriendInvitation.objects.get(receiver=ur)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                friend.create_friendship(get_user_by_auth_user(ur.auth_user), invitation)
+
+                # Another request caches the friend list as it was before the commit
+                get_friend_list(ur.id, lambda: [])
+
+        self.assertTrue(login_user(self.client, "ur"))
+        response = self.client.get(reverse("friend_list_friend"))
+        self.assertEqual(len(response.json()["data"]), 1)
+
     def test_send_invitation_from_group(self):
         """
         Send invitation from group
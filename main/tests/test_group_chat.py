@@ -3,7 +3,9 @@ Unit-tests for group chat APIs
 """
 
 from main.models import User, Chat, ChatMessage, ChatInvitation, UserChatRelation
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from main.tests.utils import JsonClient, create_user, get_user_by_name, create_friendship, login_user
@@ -47,12 +49,15 @@ class GroupChatTests(TestCase):
 
         self.assertTrue(login_user(self.client, members[0].auth_user.username))
 
-        response = self.client.post(reverse("chat_new"), {
-            "chat_name": name,
-            "chat_members": [member.id for member in members]
-        })
+        # Notifications are sent together on commit, run them so that they are covered as well
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(reverse("chat_new"), {
+                "chat_name": name,
+                "chat_members": [member.id for member in members]
+            })
 
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(callbacks), 1)
         return response.json()["data"]["chat_id"]
 
     def test_default_chat(self):
@@ -738,6 +743,116 @@ class GroupChatTests(TestCase):
         response = self.client.get(reverse("chat_list_messages", kwargs={"chat_id": 123}))
         self.assertEqual(response.status_code, 404)
 
+    def test_get_messages_paging(self):
+        """
+        Get messages page by page with offset / before and limit
+        """
+
+        # Create chat group, there is already a system message in it
+        cid = self.create_chat("chat1", [self.users[0], self.users[1]])
+        for i in range(104):
+            ChatMessage.objects.create(chat_id=cid, sender=self.users[0], message=f"Message {i}")
+
+        # First page contains the newest 100 messages
+        response = self.client.get(reverse("chat_list_messages", kwargs={"chat_id": cid}))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["data"]
+        self.assertEqual(len(data), 100)
+        self.assertEqual(data[0]["message"], "Message 103")
+
+        # Second page contains the rest
+        response = self.client.get(reverse("chat_list_messages", kwargs={"chat_id": cid}) + "?offset=100")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["data"]
+        self.assertEqual(len(data), 5)
+        self.assertEqual(data[-1]["sender"]["user_name"], "#SYSTEM")
+
+        # Invalid offsets
+        response = self.client.get(reverse("chat_list_messages", kwargs={"chat_id": cid}) + "?offset=-1")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse("chat_list_messages", kwargs={"chat_id": cid}) + "?offset=a")
+        self.assertEqual(response.status_code, 400)
+
+        # Page by the last message id received, with a limit
+        response = self.client.get(reverse("chat_list_messages", kwargs={"chat_id": cid}) + "?limit=10")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["data"]
+        self.assertEqual(len(data), 10)
+        self.assertEqual(data[-1]["message"], "Message 94")
+
+        response = self.client.get(reverse("chat_list_messages", kwargs={"chat_id": cid}) +
+                                   f"?limit=10&before={data[-1]['message_id']}")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["data"]
+        self.assertEqual(len(data), 10)
+        self.assertEqual(data[0]["message"], "Message 93")
+        self.assertEqual(data[-1]["message"], "Message 84")
+
+        # Invalid before / limit
+        response = self.client.get(reverse("chat_list_messages", kwargs={"chat_id": cid}) + "?before=a")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse("chat_list_messages", kwargs={"chat_id": cid}) + "?limit=0")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse("chat_list_messages", kwargs={"chat_id": cid}) + "?limit=101")
+        self.assertEqual(response.status_code, 400)
+
+    def add_messages(self, cid: int, count: int):
+        """
+        Add messages that are read by, replied to and deleted for some members, so that every related object of
+        ChatMessage.to_detailed_struct is present
+        """
+
+        for i in range(count):
+            message = ChatMessage.objects.create(chat_id=cid, sender=self.users[0], message=f"Message {i}")
+            message.read_users.add(self.users[0], self.users[1])
+            message.deleted_users.add(self.users[1])
+            reply = ChatMessage.objects.create(chat_id=cid, sender=self.users[1], message=f"Reply {i}",
+                                               reply_to=message)
+            reply.read_users.add(self.users[1])
+
+    def test_get_messages_query_count(self):
+        """
+        The number of queries to get or filter messages does not depend on the number of messages
+        """
+
+        small_cid = self.create_chat("small", [self.users[0], self.users[1]])
+        self.add_messages(small_cid, 2)
+        large_cid = self.create_chat("large", [self.users[0], self.users[1]])
+        self.add_messages(large_cid, 30)
+
+        self.assertTrue(login_user(self.client, "u2"))
+
+        def get_messages(cid: int) -> list:
+            response = self.client.get(reverse("chat_list_messages", kwargs={"chat_id": cid}))
+            self.assertEqual(response.status_code, 200)
+            return response.json()["data"]
+
+        def filter_messages(cid: int) -> list:
+            response = self.client.post(reverse("chat_filter_messages", kwargs={"chat_id": cid}), {
+                "sender": [self.users[0].id]
+            })
+            self.assertEqual(response.status_code, 200)
+            return response.json()["data"]
+
+        for fetch in [get_messages, filter_messages]:
+            # Warm up the session and user caches
+            fetch(small_cid)
+
+            with CaptureQueriesContext(connection) as queries:
+                small = fetch(small_cid)
+
+            with self.assertNumQueries(len(queries)):
+                large = fetch(large_cid)
+
+            self.assertGreater(len(large), len(small))
+
+        # The prefetched relations give the same result as reading each message on its own
+        u2 = self.users[1]
+        messages = ChatMessage.objects.filter(chat_id=small_cid).order_by("-id")
+        self.assertEqual(get_messages(small_cid), [message.to_detailed_struct(u2) for message in messages])
+        self.assertTrue(get_messages(small_cid)[1]["deleted"])
+        self.assertEqual(len(get_messages(small_cid)[1]["replied_by"]), 1)
+
     def test_filter_messages(self):
         """
         Filter messages by date range and sender
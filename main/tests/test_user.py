@@ -1,12 +1,18 @@
 """
 Unit tests for user-related APIs
 """
+from unittest import mock
 
-from main.models import User
+from django.contrib.auth import authenticate
+from django.db import transaction
+
+from main.auth_backend import AUTH_USER_FIELDS
+from main.cache import get_user_by_auth_user
+from main.models import User, AuthUser
 from django.test import TestCase
 from django.urls import reverse
 
-from main.tests.utils import create_user, logout_user, JsonClient, get_user_by_name
+from main.tests.utils import create_user, logout_user, JsonClient, get_user_by_name, login_user
 
 
 class UserControlTests(TestCase):
@@ -156,17 +162,38 @@ class UserControlTests(TestCase):
         # Create user
         self.assertTrue(create_user(self.client))
 
-        # Create duplicate user
-        response = self.client.post(reverse("user_register"), {
-            "user_name": "test_user",
-            "password": "test_password_2"
-        })
+        # Create duplicate user, the name is rejected by a single lookup before trying to insert
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse("user_register"), {
+                "user_name": "test_user",
+                "password": "test_password_2"
+            })
 
         # Check response status
         self.assertEqual(response.status_code, 409)
         data = response.json()
         self.assertFalse(data["ok"])
 
+    def test_create_duplicate_user_concurrently(self):
+        """
+        A name taken after the check, by a concurrent registration, is reported as a conflict by the insert
+        """
+
+        # Create user
+        self.assertTrue(create_user(self.client))
+        self.assertTrue(logout_user(self.client))
+
+        # Skip the name check as if the other registration committed right after it
+        with mock.patch.object(User, "validate_username"):
+            response = self.client.post(reverse("user_register"), {
+                "user_name": "test_user",
+                "password": "test_password_2"
+            })
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(AuthUser.objects.filter(username="test_user").count(), 1)
+        self.assertEqual(User.objects.filter(auth_user__username="test_user").count(), 1)
+
     def test_create_user_with_empty_name(self):
         """
         Create a user with no name
@@ -227,6 +254,39 @@ class UserControlTests(TestCase):
         self.assertTrue(data["ok"])
         self.assertEqual(data["data"]["user_name"], "test_user")
 
+        # The session and the user are served from cache, only the auth user is read from the database
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("user"))
+        self.assertEqual(response.json()["data"], data["data"])
+
+    def test_auth_backend(self):
+        """
+        The authentication backend loads only the columns it needs, and logging in still works
+        """
+
+        # Create user
+        self.assertTrue(create_user(self.client))
+        self.assertTrue(logout_user(self.client))
+
+        # A single query loads the auth user, with the columns other than AUTH_USER_FIELDS deferred
+        with self.assertNumQueries(1):
+            auth_user = authenticate(None, password="test_password", **{AuthUser.USERNAME_FIELD: "test_user"})
+
+        self.assertIsNotNone(auth_user)
+        self.assertEqual(auth_user.username, "test_user")
+        self.assertEqual(auth_user.get_deferred_fields(), {
+            field.attname for field in AuthUser._meta.concrete_fields
+        } - set(AUTH_USER_FIELDS))
+
+        self.assertIsNone(authenticate(None, username="test_user", password="wrong_password"))
+        self.assertIsNone(authenticate(None, username="no_such_user", password="test_password"))
+
+        # Log in through the API and use the session
+        self.assertTrue(login_user(self.client))
+        response = self.client.get(reverse("user"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["user_name"], "test_user")
+
     def test_delete_user(self):
         """
         Delete a user
@@ -259,6 +319,33 @@ class UserControlTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(User.objects.get(auth_user__username="test_user").auth_user.check_password("new_password"))
 
+        # The session is renewed and stays logged in
+        self.assertEqual(self.client.get(reverse("user")).status_code, 200)
+
+    def test_user_cache_cleared_on_commit(self):
+        """
+        A user cached again while its change is not yet committed is dropped from the cache on commit
+        """
+
+        # Create user
+        self.assertTrue(create_user(self.client))
+        auth_user = AuthUser.objects.get(username="test_user")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                auth_user.set_password("new_password")
+                auth_user.save()
+
+                # Another request reads and caches the user before the commit
+                get_user_by_auth_user(auth_user)
+                with self.assertNumQueries(0):
+                    get_user_by_auth_user(auth_user)
+
+        # The user is read from the database again after the commit
+        with self.assertNumQueries(1):
+            user = get_user_by_auth_user(auth_user)
+        self.assertTrue(user.auth_user.check_password("new_password"))
+
     def test_modify_user_password_fail(self):
         """
         Modify a user's password with wrong old password
@@ -339,6 +426,33 @@ class UserControlTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()["data"]["avatar_url"], avatar_url)
 
+        # The cached user is invalidated, later requests see the new avatar
+        response = self.client.get(reverse("user"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["avatar_url"], avatar_url)
+
+    def test_reset_user_avatar(self):
+        """
+        Reset a user's avatar to the generated one
+        """
+
+        # Create user
+        self.assertTrue(create_user(self.client))
+        generated_avatar_url = self.client.get(reverse("user")).json()["data"]["avatar_url"]
+        self.assertTrue(generated_avatar_url.startswith("data:image/png;base64,"))
+
+        # Change the avatar, then reset it; the same user name always generates the same avatar
+        response = self.client.patch(reverse("user"), {
+            "avatar_url": "https://localhost:8000/avatar.jpg"
+        })
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.patch(reverse("user"), {
+            "avatar_url": ""
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["avatar_url"], generated_avatar_url)
+
     def test_modify_user_avatar_non_http(self):
         """
         Try to set a non-HTTP avatar URL
@@ -3,12 +3,15 @@ Unit tests for main websocket
 """
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from channels.testing import WebsocketCommunicator
 from django.urls import reverse
 
 from main.tests.utils import JsonClient, create_user, get_user_by_name, logout_user, create_friendship, login_user
 from main.ws import MainWebsocketConsumer
+from main.ws.action import sync_mark_chat_read
 from main.models import Chat, ChatMessage, User
 
 
@@ -495,3 +498,78 @@ class TestWebsocket(TestCase):
         notification = await self.communicator.receive_json_from()
         self.assertFalse(notification["ok"])
         self.assertEqual(notification["code"], 400)
+
+    def test_mark_chat_read_inserts_unread_only(self):
+        """
+        Marking a chat as read only inserts read marks for the messages that are not read yet
+        """
+
+        client = JsonClient()
+        self.assertTrue(create_user(client, "main"))
+        self.assertTrue(create_user(client, "other"))
+        self.assertTrue(create_friendship(client, "main", "other"))
+        user = get_user_by_name("main")
+        chat = Chat.objects.filter(name="").last()
+        ChatMessage.objects.create(chat=chat, sender=user, message="Hello")
+
+        sync_mark_chat_read(user, chat)
+        self.assertEqual(ChatMessage.objects.filter(chat=chat).exclude(read_users=user).count(), 0)
+
+        # Nothing is inserted when all messages are read
+        with CaptureQueriesContext(connection) as queries:
+            sync_mark_chat_read(user, chat)
+        self.assertFalse(any(query["sql"].startswith("INSERT") for query in queries))
+
+        # Only the new message is inserted
+        message = ChatMessage.objects.create(chat=chat, sender=get_user_by_name("other"), message="Hi")
+        read_marks = ChatMessage.read_users.through.objects.filter(user=user)
+        count = read_marks.count()
+        sync_mark_chat_read(user, chat)
+        self.assertEqual(read_marks.count(), count + 1)
+        self.assertTrue(read_marks.filter(chatmessage=message).exists())
+
+    async def test_removed_from_group_chat(self):
+        """
+        Test that a member removed from a group chat is notified and the socket keeps working
+        """
+
+        await self.setup()
+        await self.create_chat()
+
+        def create_group_chat_sync() -> int:
+            self.assertTrue(login_user(self.client, "other"))
+            response = self.client.post(reverse("chat_new"), {
+                "chat_name": "group",
+                "chat_members": [self.other.id, self.user.id],
+            })
+            self.assertEqual(response.status_code, 200)
+            return response.json()["data"]["chat_id"]
+
+        chat_id = await database_sync_to_async(create_group_chat_sync)()
+
+        connected, _ = await self.communicator.connect()
+        self.assertTrue(connected)
+
+        # Wait for the socket to join its groups
+        await self.communicator.send_json_to({"action": "ping"})
+        response = await self.communicator.receive_json_from()
+        self.assertEqual(response["action"], "pong")
+
+        # The owner removes the user from the group chat
+        def remove_member_sync():
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.delete(reverse("chat_remove_member", args=[chat_id, self.user.id]))
+            self.assertEqual(response.status_code, 200)
+
+        await database_sync_to_async(remove_member_sync)()
+
+        notification = await self.communicator.receive_json_from()
+        self.assertEqual(notification["action"], "member_deleted")
+        self.assertEqual(notification["data"], {"chat_id": chat_id, "user_id": self.user.id})
+
+        notification = await self.communicator.receive_json_from()
+        self.assertEqual(notification["action"], "new_message")
+
+        await self.communicator.send_json_to({"action": "ping"})
+        response = await self.communicator.receive_json_from()
+        self.assertEqual(response["action"], "pong")
@@ -1,9 +1,36 @@
 import inspect
 import json
 
-from django.http import HttpResponse, JsonResponse, HttpRequest
+import orjson
+from django.http import HttpResponse, HttpRequest
 from django.conf import settings
 from main.exceptions import FieldMissingError, FieldTypeError, ClientSideError
+from main.cache import get_user_by_auth_user
+from main.models import User
+
+
+class JsonResponse(HttpResponse):
+    """
+    Drop-in replacement of django.http.JsonResponse which encodes data with orjson.
+    """
+
+    def __init__(self, data: any, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS), **kwargs)
+
+
+def get_session_user(request: HttpRequest) -> User:
+    """
+    Get the User of the current session, together with its auth_user and default_group.
+
+    The result is cached on the request, so that the user is fetched at most once per request; across requests the
+    user is cached by main.cache.
+    """
+
+    if not hasattr(request, "_cached_session_user"):
+        request._cached_session_user = get_user_by_auth_user(request.user)
+
+    return request._cached_session_user
 
 
 def api(allowed_methods: list[str] = None, needs_auth: bool = True):
@@ -13,8 +40,9 @@ def api(allowed_methods: list[str] = None, needs_auth: bool = True):
 
     This function never throws, and always returns a JsonResponse (for all but OPTIONS requests).
 
-    The decorated function may have a data (JSON data), request (raw HTTPRequest), method (string request method)
-    or auth_user (AuthUser) parameter with *args, **kwargs, and should return an object or a tuple of (status, string).
+    The decorated function may have a data (JSON data), request (raw HTTPRequest), method (string request method),
+    auth_user (AuthUser) or user (User of the session, see get_session_user) parameter with *args, **kwargs, and should
+    return an object or a tuple of (status, string).
 
     Any api accepts an OPTIONS request and returns a response with the allowed methods in the "Allow" header.
 
@@ -60,6 +88,9 @@ def api(allowed_methods: list[str] = None, needs_auth: bool = True):
         allowed_methods.append("OPTIONS")
 
     def decorator(function):
+        # Inspect the view once, instead of on every request
+        parameters = inspect.signature(function).parameters
+
         def decorated(request: HttpRequest, *args, **kwargs) -> HttpResponse:
             # Always allow OPTIONS requests
             if request.method == "OPTIONS":
@@ -101,8 +132,6 @@ def api(allowed_methods: list[str] = None, needs_auth: bool = True):
                     })
 
             try:
-                parameters = inspect.signature(function).parameters
-
                 if "request" in parameters:
                     kwargs["request"] = request
                 if "auth_user" in parameters:
@@ -111,6 +140,8 @@ def api(allowed_methods: list[str] = None, needs_auth: bool = True):
                     kwargs["data"] = data
                 if "method" in parameters:
                     kwargs["method"] = request.method
+                if "user" in parameters:
+                    kwargs["user"] = get_session_user(request)
 
                 if "kwargs" in parameters:
                     kwargs["request"] = request
@@ -166,22 +197,26 @@ def check_fields(struct: dict):
     """
 
     def decorator(function):
+        parameters = inspect.signature(function).parameters
+        struct_items = list(struct.items())
+        unused_keys = [key for key in ["request", "auth_user", "method"] if key not in parameters]
+
         def decorated(data: any, **kwargs):
             if not isinstance(data, dict):
                 raise ClientSideError("Data should be a JSON dictionary")
 
-            for key, value in struct.items():
+            for key, value in struct_items:
                 if key not in data:
                     raise FieldMissingError(key)
 
                 if not isinstance(data[key], value):
                     raise FieldTypeError(key)
 
-            parameters = inspect.signature(function).parameters
+            if "user" in parameters:
+                kwargs["user"] = get_session_user(kwargs["request"])
 
-            for key in ["request", "auth_user", "method"]:
-                if key not in parameters and key in kwargs:
-                    del kwargs[key]
+            for key in unused_keys:
+                kwargs.pop(key, None)
 
             kwargs["data"] = data
 
@@ -1,11 +1,18 @@
 import datetime
 import math
 
-from django.db.models import QuerySet
+from django.db import transaction
+from django.http import HttpRequest
 
 from .api_utils import api, check_fields
-from main.models import Chat, ChatMessage, User, AuthUser, Friend, UserChatRelation, ChatInvitation
+from main.models import Chat, ChatMessage, User, Friend, UserChatRelation, ChatInvitation
 from main.exceptions import ClientSideError
+from main.ws.notification import notify_chat_member_invitation, notify_chat_to_be_deleted, notify_admin_state_change, \
+    group_send_all, new_chat_sends, new_message_sends, chat_member_added_sends, admin_state_change_sends, \
+    owner_state_change_sends, chat_member_removal_sends
+
+# Maximum number of messages returned by a single get_messages call
+MESSAGE_PAGE_SIZE = 100
 
 
 def prohibit_private_chat(chat: Chat):
@@ -21,7 +28,7 @@ def prohibit_private_chat(chat: Chat):
 @check_fields({
     "chat_members": list
 })
-def new_chat(data: dict, auth_user: AuthUser):
+def new_chat(data: dict, user: User):
     """
     POST /chat/new
 
@@ -51,8 +58,6 @@ def new_chat(data: dict, auth_user: AuthUser):
     Chat.validate_name(data.get("chat_name"))
     chat_name: str = data["chat_name"]
 
-    user = User.objects.get(auth_user=auth_user)
-
     members_id: list = data["chat_members"]
     members: set[User] = {user}
 
@@ -65,31 +70,31 @@ def new_chat(data: dict, auth_user: AuthUser):
         if member_id == user.id:
             continue
 
-        m = Friend.objects.filter(user=user, friend__id=member_id)
-        if not m.exists():
+        m = Friend.objects.select_related("friend__auth_user").filter(user=user, friend__id=member_id).first()
+        if m is None:
             return 400, "Either the user does not exist or is not a friend of the current user"
 
-        members.add(m.first().friend)
+        members.add(m.friend)
 
-    # Create chat
-    chat = Chat(name=chat_name, owner=user)
-    chat.save()
-    chat.members.set(members)
+    with transaction.atomic():
+        # Create chat
+        chat = Chat(name=chat_name, owner=user)
+        chat.save()
+        chat.members.set(members)
 
-    # Create associated user-chat messages
-    for member in members:
-        UserChatRelation(user=member, chat=chat, nickname="").save()
+        # Create associated user-chat messages
+        for member in members:
+            UserChatRelation(user=member, chat=chat, nickname="").save()
 
-    members_str = ", ".join([member.auth_user.username for member in members])
+        members_str = ", ".join([member.auth_user.username for member in members])
 
-    # Create a "group added" message
-    msg = ChatMessage.objects.create(chat=chat, sender=User.magic_user_system(),
-                                     message=f"Group {chat_name} created by {auth_user.username} with {members_str}")
+        # Create a "group added" message
+        msg = ChatMessage.objects.create(chat=chat, sender=User.magic_user_system(),
+                                         message=f"Group {chat_name} created by {user.auth_user.username} "
+                                                 f"with {members_str}")
 
-    # Notify all members for a new chat and the new message
-    from main.ws.notification import notify_new_chat, notify_new_message
-    notify_new_chat(chat)
-    notify_new_message(msg)
+        # Notify all members for a new chat and the new message after the chat is committed
+        transaction.on_commit(lambda: group_send_all(new_chat_sends(chat) + new_message_sends(msg)))
 
     # Return chat information
     return chat.to_struct(user)
@@ -99,7 +104,7 @@ def new_chat(data: dict, auth_user: AuthUser):
 @check_fields({
     "user_id": int
 })
-def invite_to_chat(data: dict, chat_id: int, auth_user: AuthUser):
+def invite_to_chat(data: dict, chat_id: int, user: User):
     """
     POST /chat/<chat_id>/invite
 
@@ -118,8 +123,6 @@ def invite_to_chat(data: dict, chat_id: int, auth_user: AuthUser):
     The user MUST be an existing user and a friend to the current user, or the API will return 400.
     """
 
-    user: User = User.objects.get(auth_user=auth_user)
-
     member_id: int = data["user_id"]
 
     if not isinstance(member_id, int):
@@ -128,25 +131,24 @@ def invite_to_chat(data: dict, chat_id: int, auth_user: AuthUser):
     if member_id == user.id:
         return 400, "Cannot invite yourself"
 
-    m = Friend.objects.filter(user=user, friend__id=member_id)
-    if not m.exists():
+    m = Friend.objects.select_related("friend").filter(user=user, friend__id=member_id).first()
+    if m is None:
         return 400, "Either the user does not exist or is not a friend of the current user"
 
-    member: User = m.first().friend
-
-    chat: QuerySet = Chat.objects.filter(id=chat_id)
+    member: User = m.friend
 
-    if not chat.exists():
+    chat: Chat | None = Chat.objects.filter(id=chat_id).first()
+    if chat is None:
         return 400, "Chat not found"
 
-    chat: Chat = chat.first()
-
     prohibit_private_chat(chat)
 
-    if user not in chat.members.all():
+    member_ids = set(chat.members.values_list("id", flat=True))
+
+    if user.id not in member_ids:
         return 403, "You don't have permission to invite to this chat"
 
-    if member in chat.members.all():
+    if member.id in member_ids:
         return 400, "User is already in the chat"
 
     # If a previous invitation exists, delete it
@@ -155,12 +157,11 @@ def invite_to_chat(data: dict, chat_id: int, auth_user: AuthUser):
     # Create a chat invitation
     invitation = ChatInvitation.objects.create(chat=chat, user=member, invited_by=user)
 
-    from main.ws.notification import notify_chat_member_invitation
-    notify_chat_member_invitation(invitation)
+    transaction.on_commit(lambda: notify_chat_member_invitation(invitation))
 
 
 @api()
-def list_invitation(auth_user: AuthUser, chat_id: int):
+def list_invitation(user: User, chat_id: int):
     """
     GET /chat/<chat_id>/invitation
 
@@ -177,22 +178,18 @@ def list_invitation(auth_user: AuthUser, chat_id: int):
     If the user is neither the owner nor an admin of the chat, the API will return 403.
     """
 
-    user: User = User.objects.get(auth_user=auth_user)
-    chat: QuerySet = Chat.objects.filter(id=chat_id)
-
-    if not chat.exists():
+    chat: Chat | None = Chat.objects.filter(id=chat_id).first()
+    if chat is None:
         return 400, "Chat not found"
 
-    chat: Chat = chat.first()
-
-    if user != chat.owner and user not in chat.admins.all():
+    if user.id != chat.owner_id and not chat.admins.filter(id=user.id).exists():
         return 403, "You don't have permission to view the invitations"
 
     return [invitation.to_struct() for invitation in ChatInvitation.objects.filter(chat=chat)]
 
 
 @api(allowed_methods=["POST", "DELETE"])
-def respond_to_invitation(auth_user: AuthUser, chat_id: int, user_id: int, method: str):
+def respond_to_invitation(user: User, chat_id: int, user_id: int, method: str):
     """
     POST / DELETE /chat/<chat_id>/invitation/<user_id>
 
@@ -221,52 +218,47 @@ def respond_to_invitation(auth_user: AuthUser, chat_id: int, user_id: int, metho
     The invitation will be deleted.
     """
 
-    user: User = User.objects.get(auth_user=auth_user)
-    chat: QuerySet = Chat.objects.filter(id=chat_id)
+    # Fetch the invitation along with its chat and the users named in the system message in one query
+    invitation: ChatInvitation | None = ChatInvitation.objects \
+        .select_related("chat", "user__auth_user", "invited_by__auth_user") \
+        .filter(chat_id=chat_id, user_id=user_id).first()
 
-    if not chat.exists():
-        return 400, "Chat not found"
+    # The chat is only looked up separately when there is no such invitation
+    chat: Chat | None = invitation.chat if invitation is not None else Chat.objects.filter(id=chat_id).first()
 
-    chat: Chat = chat.first()
+    if chat is None:
+        return 400, "Chat not found"
 
-    if user != chat.owner and user not in chat.admins.all():
+    if user.id != chat.owner_id and not chat.admins.filter(id=user.id).exists():
         return 403, "You don't have permission to approve or decline the invitation"
 
-    invitation: QuerySet = ChatInvitation.objects.filter(chat=chat, user__id=user_id)
-
-    if not invitation.exists():
+    if invitation is None:
         return 400, "Invitation not found"
 
-    invitation: ChatInvitation = invitation.first()
-
     if method == "DELETE":
         invitation.delete()
         return
 
-    # Accept the invitation
+    # Accept the invitation, all changes are applied at once
     member: User = invitation.user
-    chat.members.add(member)
-    UserChatRelation.objects.create(user=member, chat=chat, nickname="")
-    from main.ws.notification import notify_chat_member_added
-    notify_chat_member_added(chat, member)
-
-    # Send a system message
-    msg = ChatMessage.objects.create(chat=chat, sender=User.magic_user_system(),
-                                     message=f"{auth_user.username} approved " +
-                                             f"{member.auth_user.username} to join the group, " +
-                                             f"invited by {invitation.invited_by.auth_user.username}")
+    with transaction.atomic():
+        chat.members.add(member)
+        UserChatRelation.objects.create(user=member, chat=chat, nickname="")
 
-    from main.ws.notification import notify_new_message
-    notify_new_message(msg)
+        # Send a system message
+        msg = ChatMessage.objects.create(chat=chat, sender=User.magic_user_system(),
+                                         message=f"{user.auth_user.username} approved " +
+                                                 f"{member.auth_user.username} to join the group, " +
+                                                 f"invited by {invitation.invited_by.auth_user.username}")
 
-    invitation.delete()
+        # Delete the invitation, as well as other invitations of the same user
+        ChatInvitation.objects.filter(chat=chat, user=member).delete()
 
-    # Also delete other invitations from the same user
-    ChatInvitation.objects.filter(chat=chat, user=member).delete()
+        transaction.on_commit(lambda: group_send_all(chat_member_added_sends(chat, member) + new_message_sends(msg)))
 
 
 @api()
-def list_chats(auth_user: AuthUser):
+def list_chats(user: User):
     """
     GET /chat
 
@@ -278,13 +270,11 @@ def list_chats(auth_user: AuthUser):
     Each chat will be returned in the format of UserChatRelation.to_struct.
     """
 
-    user = User.objects.get(auth_user=auth_user)
-
     return [relation.to_struct() for relation in UserChatRelation.objects.filter(user=user)]
 
 
 @api(allowed_methods=["GET", "DELETE"])
-def query_chat(chat_id: int, auth_user: AuthUser, method: str):
+def query_chat(chat_id: int, user: User, method: str):
     """
     GET,DELETE /chat/<chat_id>
 
@@ -309,15 +299,10 @@ def query_chat(chat_id: int, auth_user: AuthUser, method: str):
     The API returns 200 status code with an empty data field if the chat is deleted successfully.
     """
 
-    user = User.objects.get(auth_user=auth_user)
-
-    relation: QuerySet = UserChatRelation.objects.filter(user=user, chat__id=chat_id)
-
-    if not relation.exists():
+    relation: UserChatRelation | None = UserChatRelation.objects.filter(user=user, chat__id=chat_id).first()
+    if relation is None:
         return 400, "Chat not found"
 
-    relation: UserChatRelation = relation.first()
-
     chat = relation.chat
 
     if method == "GET":
@@ -327,66 +312,99 @@ def query_chat(chat_id: int, auth_user: AuthUser, method: str):
 
     prohibit_private_chat(chat)
 
-    # Will delete the whole chat
+    # Will delete the whole chat; members are notified before deletion as the notification carries the chat info
     if user == chat.owner:
-        from main.ws.notification import notify_chat_to_be_deleted
         notify_chat_to_be_deleted(chat)
 
         chat.delete()
         return
 
     # Else, only the user will leave the chat
-    if user in chat.admins.all():
-        chat.admins.remove(user)
-        from main.ws.notification import notify_admin_state_change
-        notify_admin_state_change(chat, user, False)
+    with transaction.atomic():
+        sends = []
+        if chat.admins.filter(id=user.id).exists():
+            chat.admins.remove(user)
+            sends += admin_state_change_sends(chat, user, False)
 
-    from main.ws.notification import notify_chat_member_to_be_removed
-    notify_chat_member_to_be_removed(chat, user)
-    chat.members.remove(user)
-    UserChatRelation.objects.filter(user=user, chat=chat).delete()
+        sends += chat_member_removal_sends(chat, user)
+        chat.members.remove(user)
+        UserChatRelation.objects.filter(user=user, chat=chat).delete()
 
-    # Post a system message
-    msg = ChatMessage.objects.create(chat=chat, sender=User.magic_user_system(),
-                                     message=f"{auth_user.username} left the chat")
+        # Post a system message
+        msg = ChatMessage.objects.create(chat=chat, sender=User.magic_user_system(),
+                                         message=f"{user.auth_user.username} left the chat")
 
-    from main.ws.notification import notify_new_message
-    notify_new_message(msg)
+        transaction.on_commit(lambda: group_send_all(sends + new_message_sends(msg)))
 
 
 @api()
-def get_messages(chat_id: int, auth_user: AuthUser):
+def get_messages(chat_id: int, request: HttpRequest, user: User):
     """
-    GET /chat/<chat_id>/messages
+    GET /chat/<chat_id>/messages?offset=<offset>&before=<message_id>&limit=<limit>
 
-    Get all messages in a chat. (TODO: paging?)
+    Get messages in a chat, at most MESSAGE_PAGE_SIZE (100) messages are returned at a time.
 
     This API requires authentication.
 
+    The optional "before" query parameter only returns messages older than the message with the given id, so that
+    older messages can be fetched page by page by passing the id of the last message received.
+
+    The optional "offset" query parameter skips the given number of the newest messages (after "before" is applied).
+    It defaults to 0.
+
+    The optional "limit" query parameter sets the number of messages returned, from 1 to MESSAGE_PAGE_SIZE.
+    It defaults to MESSAGE_PAGE_SIZE.
+
+    The API will return 400 if any of the query parameters is not a valid integer in range.
+
     If the chat does not exist, the API will return 404.
 
     If the user doesn't belong to the chat, the API will return 403.
 
-    A successful response will return a list of messages in the chat, ordered by send time descendent.
+    A successful response will return a list of messages in the chat, ordered by message id, newest first (the same
+    order as the "before" cursor).
     """
 
-    user = User.objects.get(auth_user=auth_user)
-    chat = Chat.objects.filter(id=chat_id)
+    try:
+        offset = int(request.GET.get("offset", 0))
+    except ValueError:
+        return 400, "Invalid offset"
 
-    if not chat.exists():
-        return 404, "Chat not found"
+    if offset < 0:
+        return 400, "Invalid offset"
+
+    try:
+        before = int(request.GET["before"]) if "before" in request.GET else None
+    except ValueError:
+        return 400, "Invalid before"
+
+    try:
+        limit = int(request.GET.get("limit", MESSAGE_PAGE_SIZE))
+    except ValueError:
+        return 400, "Invalid limit"
+
+    if not 0 < limit <= MESSAGE_PAGE_SIZE:
+        return 400, "Invalid limit"
 
-    chat = chat.first()
+    chat = Chat.objects.filter(id=chat_id).first()
+    if chat is None:
+        return 404, "Chat not found"
 
-    if user not in chat.members.all():
+    if not chat.members.filter(id=user.id).exists():
         return 403, "You don't have sufficient permission to view the messages"
 
-    return [message.to_detailed_struct(user)
-            for message in ChatMessage.objects.filter(chat=chat).order_by("-send_time")]
+    messages = ChatMessage.objects.filter(chat=chat)
+    if before is not None:
+        messages = messages.filter(id__lt=before)
+
+    # Messages are ordered by id, same as the "before" cursor; ids are assigned in send order
+    messages = ChatMessage.with_struct_relations(messages.order_by("-id"))[offset:offset + limit]
+
+    return [message.to_detailed_struct(user) for message in messages]
 
 
 @api(allowed_methods=["POST"])
-def filter_messages(chat_id: int, data: dict, auth_user: AuthUser):
+def filter_messages(chat_id: int, data: dict, user: User):
     """
     POST /chat/<chat_id>/filter
 
@@ -413,14 +431,13 @@ def filter_messages(chat_id: int, data: dict, auth_user: AuthUser):
     ChatMessage.to_detailed_struct, ordered by send time descendent.
     """
 
-    user = User.objects.get(auth_user=auth_user)
-
-    try:
-        chat = Chat.objects.get(id=chat_id)
-    except Chat.DoesNotExist:
+    chat = Chat.objects.filter(id=chat_id).first()
+    if chat is None:
         return 400, "Chat not found"
 
-    if user not in chat.members.all():
+    member_ids = set(chat.members.values_list("id", flat=True))
+
+    if user.id not in member_ids:
         return 403, "You don't have permission to view the messages"
 
     if not isinstance(data, dict):
@@ -442,12 +459,11 @@ def filter_messages(chat_id: int, data: dict, auth_user: AuthUser):
             if not isinstance(s, int):
                 return 400, "Sender must be a list of user ids"
 
-            try:
-                u = User.objects.get(id=s)
-            except User.DoesNotExist:
+            u = User.objects.filter(id=s).first()
+            if u is None:
                 return 400, "User not found in this chat"
 
-            if u not in chat.members.all() and not u.system:
+            if u.id not in member_ids and not u.system:
                 return 400, "User not found in this chat"
 
             sender.append(u)
@@ -466,12 +482,16 @@ def filter_messages(chat_id: int, data: dict, auth_user: AuthUser):
     if len(filters) == 0:
         return 400, "At least one filter condition should be provided"
 
-    return [message.to_detailed_struct(user)
-            for message in ChatMessage.objects.filter(chat=chat, **filters).order_by("-send_time")]
+    # The result is not paged, iterate in chunks instead of caching all model instances at once; a chunk size is
+    # required for the related objects to be prefetched per chunk
+    messages = ChatMessage.with_struct_relations(ChatMessage.objects.filter(chat=chat, **filters)) \
+        .order_by("-send_time")
+
+    return [message.to_detailed_struct(user) for message in messages.iterator(chunk_size=500)]
 
 
 @api(allowed_methods=["POST"])
-def set_admin(data: bool, chat_id: int, member_id: int, auth_user: AuthUser):
+def set_admin(data: bool, chat_id: int, member_id: int, user: User):
     """
     POST /chat/<chat_id>/<member_id>/admin
 
@@ -495,31 +515,23 @@ def set_admin(data: bool, chat_id: int, member_id: int, auth_user: AuthUser):
     if not isinstance(data, bool):
         return 400, "Data must be a boolean"
 
-    user = User.objects.get(auth_user=auth_user)
-
-    chat: QuerySet = Chat.objects.filter(id=chat_id)
-
-    if not chat.exists():
+    chat: Chat | None = Chat.objects.filter(id=chat_id).first()
+    if chat is None:
         return 400, "Chat not found"
 
-    chat: Chat = chat.first()
-
     prohibit_private_chat(chat)
 
     if chat.owner != user:
         return 403, "You don't have permission to set admin"
 
-    member = chat.members.filter(id=member_id)
-
-    if not member.exists():
+    member = chat.members.filter(id=member_id).first()
+    if member is None:
         return 400, "Member not found"
 
-    member = member.first()
-
     if member == chat.owner:
         return 400, "You cannot set admin status of the chat owner"
 
-    is_admin = member in chat.admins.all()
+    is_admin = chat.admins.filter(id=member.id).exists()
 
     if data == is_admin:
         return 400, "Member is already an admin" if data else "Member is not an admin currently"
@@ -530,15 +542,14 @@ def set_admin(data: bool, chat_id: int, member_id: int, auth_user: AuthUser):
         chat.admins.remove(member)
 
     # Notify the chat members
-    from main.ws.notification import notify_admin_state_change
-    notify_admin_state_change(chat, member, data)
+    transaction.on_commit(lambda: notify_admin_state_change(chat, member, data))
 
 
 @api(allowed_methods=["POST"])
 @check_fields({
     "chat_owner": int
 })
-def set_owner(data: dict, chat_id: int, auth_user: AuthUser):
+def set_owner(data: dict, chat_id: int, user: User):
     """
     POST /chat/<chat_id>/set_owner
 
@@ -559,44 +570,43 @@ def set_owner(data: dict, chat_id: int, auth_user: AuthUser):
     If the user is already the owner / the user is not in the group, the API will return 400.
     """
 
-    from main.ws.notification import notify_admin_state_change, notify_owner_state_change
-
     new_owner_id = data["chat_owner"]
-    user = User.objects.get(auth_user=auth_user)
-    chat = Chat.objects.filter(id=chat_id)
-
-    if not chat.exists():
+    chat = Chat.objects.filter(id=chat_id).first()
+    if chat is None:
         return 400, "Chat not found"
 
-    chat = chat.first()
-
     prohibit_private_chat(chat)
 
     if chat.owner != user:
         return 403, "You don't have permission to set owner of this chat"
 
-    member = chat.members.filter(id=new_owner_id)
-    if not member.exists():
+    member = chat.members.filter(id=new_owner_id).first()
+    if member is None:
         return 400, "Member not found"
 
-    member = member.first()
     if member == chat.owner:
         return 400, "Member is already the owner"
 
-    if member in chat.admins.all():
-        chat.admins.remove(member)
-        notify_admin_state_change(chat, member, False)
+    with transaction.atomic():
+        sends = []
+
+        # Remove the new owner from the admin list, the deleted row count tells whether it was an admin
+        removed, _ = Chat.admins.through.objects.filter(chat_id=chat.id, user_id=member.id).delete()
+        if removed:
+            sends += admin_state_change_sends(chat, member, False)
+
+        chat.owner = member
+        chat.save(update_fields=["owner"])
+        sends += owner_state_change_sends(chat)
 
-    chat.owner = member
-    chat.save()
-    notify_owner_state_change(chat)
+        Chat.admins.through.objects.create(chat_id=chat.id, user_id=user.id)
+        sends += admin_state_change_sends(chat, user, True)
 
-    chat.admins.add(user)
-    notify_admin_state_change(chat, user, True)
+        transaction.on_commit(lambda: group_send_all(sends))
 
 
 @api(allowed_methods=["DELETE"])
-def remove_member(chat_id: int, member_id: int, auth_user: AuthUser):
+def remove_member(chat_id: int, member_id: int, user: User):
     """
     DELETE /chat/<chat_id>/<member_id>
 
@@ -611,46 +621,41 @@ def remove_member(chat_id: int, member_id: int, auth_user: AuthUser):
     If the operation completes successfully, the API will return 200 with an empty data field.
     """
 
-    user = User.objects.get(auth_user=auth_user)
-    chat = Chat.objects.filter(id=chat_id)
-
-    if not chat.exists():
+    chat = Chat.objects.filter(id=chat_id).first()
+    if chat is None:
         return 400, "Chat not found"
 
-    chat = chat.first()
-
     prohibit_private_chat(chat)
 
-    if chat.owner != user and user not in chat.admins.all():
+    if chat.owner_id != user.id and not chat.admins.filter(id=user.id).exists():
         return 403, "You don't have permission to remove a member"
 
-    member: QuerySet = chat.members.filter(id=member_id)
-
-    if not member.exists():
+    member: User | None = chat.members.filter(id=member_id).first()
+    if member is None:
         return 400, "Member not found"
 
-    member: User = member.first()
-
     if member == chat.owner:
         return 403, "You don't have the permission to remove the chat owner"
 
-    if member in chat.admins.all():
-        if user != chat.owner:
-            return 403, "You don't have the permission to remove an admin"
+    is_admin = chat.admins.filter(id=member.id).exists()
 
-        chat.admins.remove(member)
-        from main.ws.notification import notify_admin_state_change
-        notify_admin_state_change(chat, member, False)
+    if is_admin and user != chat.owner:
+        return 403, "You don't have the permission to remove an admin"
+
+    with transaction.atomic():
+        sends = []
+        if is_admin:
+            chat.admins.remove(member)
+            sends += admin_state_change_sends(chat, member, False)
 
-    # Notify the chat members that a member is to be removed
-    from main.ws.notification import notify_chat_member_to_be_removed
-    notify_chat_member_to_be_removed(chat, member)
-    chat.members.remove(member)
-    UserChatRelation.objects.filter(user=member, chat=chat).delete()
+        # Notify the chat members that a member is removed
+        sends += chat_member_removal_sends(chat, member)
+        chat.members.remove(member)
+        UserChatRelation.objects.filter(user=member, chat=chat).delete()
 
-    # Add a system message
-    msg = ChatMessage.objects.create(chat=chat, sender=User.magic_user_system(),
-                                     message=f"{auth_user.username} removed {member.auth_user.username} from the group")
+        # Add a system message
+        msg = ChatMessage.objects.create(chat=chat, sender=User.magic_user_system(),
+                                         message=f"{user.auth_user.username} removed {member.auth_user.username} "
+                                                 f"from the group")
 
-    from main.ws.notification import notify_new_message
-    notify_new_message(msg)
+        transaction.on_commit(lambda: group_send_all(sends + new_message_sends(msg)))
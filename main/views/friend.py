@@ -2,12 +2,17 @@
 Friend control
 """
 
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
 from main.models import User, AuthUser, Friend, FriendInvitation, FriendGroup, Chat, UserChatRelation, ChatMessage
+from main.cache import get_friend_list, invalidate_friend_lists
 from main.views.api_utils import api, check_fields
+from main.ws.notification import group_send_all, friend_created_sends, new_message_sends, friend_deletion_sends
 
 
 @api(allowed_methods=["POST"])
-def find(data: dict, auth_user: AuthUser):
+def find(data: dict, user: User):
     """
     POST /friend/find
 
@@ -41,15 +46,12 @@ def find(data: dict, auth_user: AuthUser):
     If none of the filters are provided, the API returns 400 status code.
     """
 
-    user = User.objects.get(auth_user=auth_user)
-
     if "id" in data:
         if not isinstance(data["id"], int):
             return 400, "Invalid user ID"
 
-        try:
-            u = User.objects.get(id=data["id"])
-        except User.DoesNotExist:
+        u = User.objects.select_related("auth_user").filter(id=data["id"]).first()
+        if u is None:
             return []
 
         # Do not return the current user
@@ -66,15 +68,12 @@ def find(data: dict, auth_user: AuthUser):
         if not isinstance(data["name_contains"], str):
             return 400, "Invalid name_contains"
 
-        qs = User.objects.filter(auth_user__username__contains=data["name_contains"], system=False)
-        result = []
-        for u in qs:
-            if u == user:
-                continue
-
-            result.append(u.to_basic_struct())
+        # Exclude the current user in the query, and read plain rows instead of creating model instances
+        rows = User.objects.filter(auth_user__username__contains=data["name_contains"], system=False) \
+            .exclude(id=user.id) \
+            .values(*User.basic_struct_fields())
 
-        return result
+        return [User.basic_struct_from_row(row) for row in rows]
 
     return 400, "No filter provided"
 
@@ -92,28 +91,34 @@ def create_friendship(user: User, invitation: FriendInvitation) -> Friend:
 
     sender = invitation.sender
 
-    # Create the friendship
-    friend: Friend = Friend.objects.create(user=user, friend=sender, nickname="", group=user.default_group)
-    Friend.objects.create(user=sender, friend=user, nickname="", group=sender.default_group)
-    invitation.delete()
+    with transaction.atomic():
+        # Create the friendship; the current user's default group is loaded with the user (see get_session_user)
+        # and is needed for the returned struct, while the sender's is only referenced by id
+        friend, _ = Friend.objects.bulk_create([
+            Friend(user=user, friend=sender, nickname="", group=user.default_group),
+            Friend(user=sender, friend=user, nickname="", group_id=sender.default_group_id),
+        ])
+        invitation.delete()
 
-    # Notify users of the new friendship
-    from main.ws.notification import notify_friend_created
-    notify_friend_created(user, sender)
+        # Create a chat for the new friendship
+        chat = Chat.objects.create(owner=user, name="")
+        chat.members.set([user, sender])
+        UserChatRelation.objects.bulk_create([
+            UserChatRelation(user=user, chat=chat, nickname=""),
+            UserChatRelation(user=sender, chat=chat, nickname=""),
+        ])
 
-    # Create a chat for the new friendship
-    chat = Chat.objects.create(owner=user, name="")
-    chat.members.set([user, sender])
-    UserChatRelation.objects.create(user=user, chat=chat, nickname="")
-    UserChatRelation.objects.create(user=sender, chat=chat, nickname="")
+        # Create a "friend added" message
+        msg = ChatMessage.objects.create(chat=chat, sender=User.magic_user_system(),
+                                         message=f"{user.auth_user.username} added "
+                                                 f"{sender.auth_user.username} as a friend")
 
-    # Create a "friend added" message
-    msg = ChatMessage.objects.create(chat=chat, sender=User.magic_user_system(),
-                                     message=f"{user.auth_user.username} added {sender.auth_user.username} as a friend")
+        # bulk_create sends no post_save signal; the lists are cleared again on commit, so that a list read
+        # concurrently before the commit is not kept in the cache
+        invalidate_friend_lists(user.id, sender.id)
 
-    # Notify users of the new message
-    from main.ws.notification import notify_new_message
-    notify_new_message(msg)
+        # Notify users of the new friendship and the new message after the transaction is committed
+        transaction.on_commit(lambda: group_send_all(friend_created_sends(user, sender) + new_message_sends(msg)))
 
     return friend
 
@@ -122,7 +127,7 @@ def create_friendship(user: User, invitation: FriendInvitation) -> Friend:
 @check_fields({
     "id": int
 })
-def send_invitation(data: dict, auth_user: AuthUser):
+def send_invitation(data: dict, user: User):
     """
     POST /friend/invite
 
@@ -150,24 +155,26 @@ def send_invitation(data: dict, auth_user: AuthUser):
 
     FriendInvitation.validate_comment(data.get("comment"))
 
-    user = User.objects.get(auth_user=auth_user)
+    # Check if the user exists, and whether it is a friend / has invited the current user in the same query
+    friend: User | None = User.objects.filter(id=data["id"]).annotate(
+        is_friend=Exists(Friend.objects.filter(user=user, friend=OuterRef("pk"))),
+        has_invited=Exists(FriendInvitation.objects.filter(sender=OuterRef("pk"), receiver=user)),
+    ).first()
 
-    # Check if the user exists
-    try:
-        friend = User.objects.get(id=data["id"])
-    except User.DoesNotExist:
+    if friend is None:
         return 400, "User not found"
 
-    if friend == user:
+    if friend.id == user.id:
         return 400, "Cannot invite yourself as a friend"
 
     # Check if the user is already a friend
-    if Friend.objects.filter(user=user, friend=friend).exists():
+    if friend.is_friend:
         return 409, "User is already a friend"
 
     # If the user receives an invitation from the sender, accept it
-    if FriendInvitation.objects.filter(sender=friend, receiver=user).exists():
-        f = create_friendship(user, FriendInvitation.objects.get(sender=friend, receiver=user))
+    if friend.has_invited:
+        invitation = FriendInvitation.objects.select_related("sender__auth_user").get(sender=friend, receiver=user)
+        f = create_friendship(user, invitation)
         return f.to_struct()
 
     # Check invitation source
@@ -184,30 +191,33 @@ def send_invitation(data: dict, auth_user: AuthUser):
     elif isinstance(data["source"], int):
         source = data["source"]
 
-        try:
-            chat = Chat.objects.get(id=source)
-        except Chat.DoesNotExist:
+        # Check the chat and the membership of both users in the same query
+        members = Chat.members.through.objects.filter(chat_id=OuterRef("pk"))
+        chat: Chat | None = Chat.objects.filter(id=source).annotate(
+            user_is_member=Exists(members.filter(user_id=user.id)),
+            friend_is_member=Exists(members.filter(user_id=friend.id)),
+        ).first()
+
+        if chat is None:
             return 400, "Invitation source not found"
 
-        if user not in chat.members.all():
+        if not chat.user_is_member:
             return 400, "You are not a member of the source chat"
 
-        if friend not in chat.members.all():
+        if not chat.friend_is_member:
             return 400, "Friend is not a member of the source chat"
 
     else:
         return 400, "Invalid source"
 
-    # Delete previous invitation
-    FriendInvitation.objects.filter(sender=user, receiver=friend).delete()
-
-    # Create the invitation
-    invitation = FriendInvitation(sender=user, receiver=friend, comment=data["comment"], source=source)
-    invitation.save()
+    # Create the invitation or replace the previous one in place, update_or_create retries the lookup if a concurrent
+    # request inserts the same (sender, receiver) invitation first
+    FriendInvitation.objects.update_or_create(sender=user, receiver=friend,
+                                              defaults={"comment": data["comment"], "source": source})
 
 
 @api(allowed_methods=["GET"])
-def list_invitation(auth_user: AuthUser):
+def list_invitation(user: User):
     """
     GET /friend/invitation
 
@@ -239,14 +249,14 @@ def list_invitation(auth_user: AuthUser):
     }
     """
 
-    user = User.objects.get(auth_user=auth_user)
-    invitations = FriendInvitation.objects.filter(receiver=user)
+    # Read plain rows instead of creating model instances
+    invitations = FriendInvitation.objects.filter(receiver=user).values(*FriendInvitation.struct_fields())
 
-    return [i.to_struct() for i in invitations]
+    return [FriendInvitation.struct_from_row(row) for row in invitations]
 
 
 @api(allowed_methods=["POST", "DELETE"])
-def respond_to_invitation(method: str, auth_user: AuthUser, invitation_id: int):
+def respond_to_invitation(method: str, user: User, invitation_id: int):
     """
     POST, DELETE /friend/invitation/<int:invitation_id>
 
@@ -258,16 +268,15 @@ def respond_to_invitation(method: str, auth_user: AuthUser, invitation_id: int):
     If an invitation was found but the receiver is not the current user, the API returns 403 status code.
     """
 
-    user = User.objects.get(auth_user=auth_user)
+    invitation = FriendInvitation.objects.select_related("sender__auth_user") \
+        .filter(id=invitation_id, receiver=user).first()
+    if invitation is None:
+        # Tell a missing invitation from someone else's only on a miss
+        if FriendInvitation.objects.filter(id=invitation_id).exists():
+            return 403, "Forbidden"
 
-    try:
-        invitation = FriendInvitation.objects.get(id=invitation_id)
-    except FriendInvitation.DoesNotExist:
         return 400, "Invitation not found"
 
-    if invitation.receiver != user:
-        return 403, "Forbidden"
-
     if method == "POST":
         friend = create_friendship(user, invitation)
         return friend.to_struct()
@@ -322,9 +331,9 @@ def get_friend_info(auth_user: AuthUser, friend_id):
     }
     """
 
-    try:
-        friend = Friend.objects.get(user__auth_user=auth_user, friend__id=friend_id)
-    except Friend.DoesNotExist:
+    friend = Friend.objects.select_related("friend__auth_user", "group") \
+        .filter(user__auth_user=auth_user, friend__id=friend_id).first()
+    if friend is None:
         return 404, "Friend not found"
 
     return friend.to_struct()
@@ -349,30 +358,36 @@ def update_friend(auth_user: AuthUser, friend_id, data):
     If the update is successful, the API returns the updated friend information in the same format as the get function.
     """
 
-    try:
-        friend = Friend.objects.get(user__auth_user=auth_user, friend__id=friend_id)
-    except Friend.DoesNotExist:
+    friend = Friend.objects.filter(user__auth_user=auth_user, friend__id=friend_id).first()
+    if friend is None:
         return 400, "Friend not found"
 
+    # Only the changed columns are written
+    changed_fields = []
+
     if "nickname" in data:
         Friend.validate_nickname(data["nickname"])
         friend.nickname = data["nickname"]
+        changed_fields.append("nickname")
 
     if "group_id" in data:
         if not isinstance(data["group_id"], int):
             return 400, "Invalid group ID"
 
-        try:
-            group = FriendGroup.objects.get(id=data["group_id"])
-        except FriendGroup.DoesNotExist:
+        group = FriendGroup.objects.select_related("user") \
+            .only("id", "name", "user__auth_user").filter(id=data["group_id"]).first()
+        if group is None:
             return 400, "Group not found"
 
-        if group.user.auth_user != auth_user:
+        if group.user.auth_user_id != auth_user.id:
             return 403, "Forbidden"
 
         friend.group = group
+        changed_fields.append("group")
+
+    if changed_fields:
+        friend.save(update_fields=changed_fields)
 
-    friend.save()
     return friend.to_struct()
 
 
@@ -386,27 +401,30 @@ def delete_friend(auth_user: AuthUser, friend_id):
     if the friend is not found.
     """
 
-    try:
-        friend = Friend.objects.get(user__auth_user=auth_user, friend__id=friend_id)
-    except Friend.DoesNotExist:
+    friend = Friend.objects.select_related("user__auth_user", "friend__auth_user") \
+        .filter(user__auth_user=auth_user, friend__id=friend_id).first()
+    if friend is None:
         return 400, "Friend not found"
 
-    from main.ws.notification import notify_friend_to_be_deleted
-    notify_friend_to_be_deleted(friend)
-
-    # Delete related private chat; Private chat SHOULD always exist and be unique
-    Chat.objects.filter(owner=friend.user, members=friend.friend, name="") \
-        .union(Chat.objects.filter(owner=friend.friend, members=friend.user, name="")).first().delete()
+    with transaction.atomic():
+        # Delete related private chat; Private chat SHOULD always exist and be unique
+        chat = Chat.objects.filter(Q(owner=friend.user, members=friend.friend) |
+                                   Q(owner=friend.friend, members=friend.user), name="").first()
+        if chat is not None:
+            chat.delete()
 
-    reverse = Friend.objects.get(user=friend.friend, friend=friend.user)
-    notify_friend_to_be_deleted(reverse)
-    reverse.delete()
+        # Delete both sides of the friendship at once
+        Friend.objects.filter(Q(user=friend.user, friend=friend.friend) |
+                              Q(user=friend.friend, friend=friend.user)).delete()
 
-    friend.delete()
+        # Notify both users once the deletion is committed; the reverse friendship is only needed for notification,
+        # so it is not fetched
+        transaction.on_commit(lambda: group_send_all(
+            friend_deletion_sends(friend) + friend_deletion_sends(Friend(user=friend.friend, friend=friend.user))))
 
 
 @api(allowed_methods=["GET"])
-def list_friend(auth_user: AuthUser):
+def list_friend(user: User):
     """
     GET /friend
 
@@ -417,6 +435,10 @@ def list_friend(auth_user: AuthUser):
     This API returns a list of friends. Each friend struct looks like that returned by the get friend info function.
     """
 
-    friends = Friend.objects.filter(user__auth_user=auth_user)
+    def load():
+        # Read plain rows instead of creating model instances
+        friends = Friend.objects.filter(user=user).values(*Friend.struct_fields())
+
+        return [Friend.struct_from_row(row) for row in friends]
 
-    return [f.to_struct() for f in friends]
+    return get_friend_list(user.id, load)
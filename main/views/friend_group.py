@@ -3,11 +3,12 @@ Friend group control
 """
 
 from main.models import User, AuthUser, Friend, FriendGroup
+from main.cache import get_group_list
 from main.views.api_utils import api, check_fields
 
 
 @api(allowed_methods=["POST"])
-def add(data: dict, auth_user: AuthUser):
+def add(data: dict, user: User):
     """
     POST /friend/group/add
 
@@ -31,8 +32,6 @@ def add(data: dict, auth_user: AuthUser):
     If the group_name field is empty or is not string, or if its length exceeds 99 chars, API returns 400 status code.
     """
 
-    user: User = User.objects.get(auth_user=auth_user)
-
     FriendGroup.validate_name(data["group_name"])
 
     # Create the group
@@ -78,13 +77,13 @@ def get_info_by_id(auth_user: AuthUser, group_id: int):
     If the group does not belong to the user, the API returns 403 status code.
     """
 
-    try:
-        group: FriendGroup = FriendGroup.objects.get(id=group_id)
-    except FriendGroup.DoesNotExist:
+    group: FriendGroup | None = FriendGroup.objects.select_related("user") \
+        .only("id", "name", "default", "user__auth_user").filter(id=group_id).first()
+    if group is None:
         return 404, "Group not found"
 
     # Check if the group belongs to the user
-    if group.user.auth_user != auth_user:
+    if group.user.auth_user_id != auth_user.id:
         return 403, "Forbidden"
 
     return group.to_struct()
@@ -108,12 +107,12 @@ def edit(data: dict, auth_user: AuthUser, group_id: int):
     to change the name of the default group, this API will return 400 status code.
     """
 
-    try:
-        group: FriendGroup = FriendGroup.objects.get(id=group_id)
-    except FriendGroup.DoesNotExist:
+    group: FriendGroup | None = FriendGroup.objects.select_related("user") \
+        .only("id", "name", "default", "user__auth_user").filter(id=group_id).first()
+    if group is None:
         return 400, "Group not found"
 
-    if group.user.auth_user != auth_user:
+    if group.user.auth_user_id != auth_user.id:
         return 403, "Forbidden"
 
     if group.default:
@@ -122,7 +121,7 @@ def edit(data: dict, auth_user: AuthUser, group_id: int):
     FriendGroup.validate_name(data["group_name"])
 
     group.name = data["group_name"]
-    group.save()
+    group.save(update_fields=["name"])
 
     return group.to_struct()
 
@@ -148,31 +147,25 @@ def delete(auth_user: AuthUser, group_id: int):
     this API will return 400 status code.
     """
 
-    try:
-        group = FriendGroup.objects.get(id=group_id)
-    except FriendGroup.DoesNotExist:
+    group: FriendGroup | None = FriendGroup.objects.select_related("user") \
+        .only("id", "name", "default", "user__auth_user", "user__default_group").filter(id=group_id).first()
+    if group is None:
         return 400, "Group not found"
 
-    if group.user.auth_user != auth_user:
+    if group.user.auth_user_id != auth_user.id:
         return 403, "Forbidden"
 
     if group.default:
         return 400, "Default group cannot be deleted"
 
     # Move all users in the group to the default group
-    friends = Friend.objects.filter(group=group)
-
-    if friends.exists():
-        default_group: FriendGroup = FriendGroup.objects.get(user=group.user, default=True)
-        for friend in friends:
-            friend.group = default_group
-            friend.save()
+    Friend.objects.filter(group=group).update(group_id=group.user.default_group_id)
 
     group.delete()
 
 
 @api(allowed_methods=["GET"])
-def list_groups(auth_user: AuthUser):
+def list_groups(user: User):
     """
     GET /friend/group/list
 
@@ -197,7 +190,9 @@ def list_groups(auth_user: AuthUser):
     }
     """
 
-    user: User = User.objects.get(auth_user=auth_user)
-    groups = FriendGroup.objects.filter(user=user)
+    def load():
+        # Same dicts as FriendGroup.to_struct, built from plain rows
+        groups = FriendGroup.objects.filter(user=user).values("id", "name")
+        return [{"group_id": g["id"], "group_name": g["name"]} for g in groups]
 
-    return [g.to_struct() for g in groups]
+    return get_group_list(user.id, load)
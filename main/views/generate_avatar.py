@@ -1,33 +1,100 @@
-import pydenticon
+import functools
 import random
-import colorsys
 import hashlib
 import base64
+import struct
+import zlib
 
+# The identicon is a symmetric grid of AVATAR_CELLS x AVATAR_CELLS cells, each AVATAR_CELL_SIZE pixels wide
+AVATAR_CELLS = 8
+AVATAR_CELL_SIZE = 32
 
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def _encode_identicon_png(cells: list[list[bool]], foreground: tuple, background: tuple) -> bytes:
+    """
+    Encode a grid of cells as an indexed PNG with a two-color palette (0 = background, 1 = foreground).
+    """
+
+    size = AVATAR_CELLS * AVATAR_CELL_SIZE
+    cell_bytes = AVATAR_CELL_SIZE // 8
+
+    # Each scanline is a filter byte (0 = none) followed by 1 bit per pixel; all scanlines of a cell row are the same
+    scanlines = b""
+    for row in cells:
+        scanline = b"\x00" + b"".join((b"\xff" if cell else b"\x00") * cell_bytes for cell in row)
+        scanlines += scanline * AVATAR_CELL_SIZE
+
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 1, 3, 0, 0, 0)),
+        _png_chunk(b"PLTE", bytes(background) + bytes(foreground)),
+        _png_chunk(b"IDAT", zlib.compress(scanlines)),
+        _png_chunk(b"IEND", b""),
+    ])
+
+
+def _identicon_cells(seed: str) -> list[list[bool]]:
+    """
+    Derive a horizontally symmetric grid of cells from the seed, one bit of the digest per cell of the left half.
+    """
+
+    half = (AVATAR_CELLS + 1) // 2
+    bits = int.from_bytes(hashlib.sha256(seed.encode()).digest()[:(AVATAR_CELLS * half + 7) // 8], "big")
+
+    cells = []
+    for y in range(AVATAR_CELLS):
+        left = [bool(bits >> (y * half + x) & 1) for x in range(half)]
+        cells.append(left + left[:AVATAR_CELLS - half][::-1])
+
+    return cells
+
+
+def _hsv_to_rgb(hue: float, saturation: float, brightness: float) -> tuple[int, int, int]:
+    """
+    Convert an HSV color (each component in [0, 1]) to 8-bit RGB, same as colorsys.hsv_to_rgb scaled to 255.
+    """
+
+    sector = int(hue * 6.0)
+    f = hue * 6.0 - sector
+    v = brightness
+    p = v * (1.0 - saturation)
+    q = v * (1.0 - saturation * f)
+    t = v * (1.0 - saturation * (1.0 - f))
+
+    r, g, b = [(v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q)][sector % 6]
+    return int(r * 255), int(g * 255), int(b * 255)
+
+
+@functools.lru_cache(maxsize=4096)
 def generate_random_avatar(seed: str) -> str:
     """
     Generate base64 encoded avatar image from a seed string.
+
+    The colors are drawn from a random generator seeded with the seed string, so the same seed always produces the
+    same avatar and results are cached.
     """
 
+    rng = random.Random(seed)
+
     # Generate a random foreground color
-    hue = random.random()
-    saturation = random.random() * 0.5 + 0.3
-    brightness = random.random() * 0.4 + 0.5
-    foreground = colorsys.hsv_to_rgb(hue, saturation, brightness)
-    foreground = '#%02x%02x%02x' % (int(foreground[0] * 255), int(foreground[1] * 255), int(foreground[2] * 255))
+    hue = rng.random()
+    saturation = rng.random() * 0.5 + 0.3
+    brightness = rng.random() * 0.4 + 0.5
+    foreground = _hsv_to_rgb(hue, saturation, brightness)
 
     # Generate a random background color
-    hue = hue + 0.5 + random.random() * 0.1
+    hue = hue + 0.5 + rng.random() * 0.1
     if hue > 1:
         hue -= 1
-    saturation = random.random() * 0.15
+    saturation = rng.random() * 0.15
     brightness = 1
-    background = colorsys.hsv_to_rgb(hue, saturation, brightness)
-    background = '#%02x%02x%02x' % (int(background[0] * 255), int(background[1] * 255), int(background[2] * 255))
+    background = _hsv_to_rgb(hue, saturation, brightness)
 
     # Generate the identicon
-    identicon = pydenticon.Generator(8, 8, foreground=[foreground], background=background, digest=hashlib.sha512) \
-        .generate(seed, 256, 256)
+    identicon = _encode_identicon_png(_identicon_cells(seed), foreground, background)
 
     return f"data:image/png;base64,{base64.b64encode(identicon).decode("latin-1")}"
@@ -3,12 +3,17 @@ User Control
 """
 
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from django.http import HttpRequest
 
+from main.cache import get_user_by_auth_user
 from main.views.api_utils import api, check_fields
 from main.views.generate_avatar import generate_random_avatar
 from main.exceptions import FieldTypeError, FieldMissingError, ClientSideError
 from main.models import User, FriendGroup, Friend, AuthUser, UserChatRelation, Chat
+from main.ws.notification import notify_logout, notify_profile_change, group_send_all, friend_deletion_sends, \
+    chat_deletion_sends, chat_member_removal_sends, user_deletion_sends
 
 
 @api(allowed_methods=["POST"], needs_auth=False)
@@ -52,10 +57,7 @@ def login(data: dict, request: HttpRequest):
     User.validate_password(data.get("password"))
     password: str = data["password"]
 
-    # Authenticate user
-    if not AuthUser.objects.filter(username=user_name).exists():
-        return 403, "User does not exist or password is incorrect"
-
+    # Authenticate user; a missing user and a wrong password are reported the same way
     auth_user = authenticate(username=user_name, password=password)
     if auth_user is None:
         return 403, "User does not exist or password is incorrect"
@@ -64,13 +66,13 @@ def login(data: dict, request: HttpRequest):
     if request.user.is_authenticated:
         session_key = request.session.session_key
         auth_logout(request)
-        from main.ws.notification import notify_logout
         notify_logout(session_key)
 
     # Log user in
     auth_login(request, auth_user)
 
-    return User.objects.get(auth_user=auth_user).to_detailed_struct()
+    # Fetched with its auth_user, and cached for the following requests of the session
+    return get_user_by_auth_user(auth_user).to_detailed_struct()
 
 
 @api(allowed_methods=["POST"], needs_auth=False)
@@ -102,24 +104,30 @@ def register(data: dict, request: HttpRequest):
     If user_name or password field is empty or is not string, or if the JSON is bad, API returns 400 status code.
     """
 
+    # Reject a taken name before hashing the password and generating the avatar, the unique user name constraint
+    # still catches a concurrent registration of the same name on insert
     User.validate_username(data.get("user_name"))
     user_name: str = data["user_name"]
 
     User.validate_password(data.get("password"))
     password: str = data["password"]
 
-    # Create user
-    auth_user = AuthUser.objects.create_user(username=user_name, password=password)
-    auth_user.save()
+    with transaction.atomic():
+        # Create user, only a conflict on the user name insert is reported as 409
+        try:
+            with transaction.atomic():
+                auth_user = AuthUser.objects.create_user(username=user_name, password=password)
+        except IntegrityError:
+            return 409, "Username already exists"
 
-    user = User(auth_user=auth_user, avatar_url=generate_random_avatar(user_name))
-    user.save()
+        user = User(auth_user=auth_user, avatar_url=generate_random_avatar(user_name))
+        user.save()
 
-    # Add default friend group
-    default_group = FriendGroup(user=user, name="", default=True)
-    default_group.save()
-    user.default_group = default_group
-    user.save()
+        # Add default friend group, linked with a single column update instead of saving the whole user again
+        default_group = FriendGroup(user=user, name="", default=True)
+        default_group.save()
+        User.objects.filter(pk=user.pk).update(default_group=default_group)
+        user.default_group = default_group
 
     # Log user in
     auth_login(request, auth_user)
@@ -148,12 +156,11 @@ def logout(request):
     auth_logout(request)
 
     # Notify user of logout
-    from main.ws.notification import notify_logout
     notify_logout(session_key)
 
 
 @api(allowed_methods=["GET", "PATCH", "DELETE"])
-def query(data: dict, request):
+def query(data: dict, request: HttpRequest, user: User):
     """
     GET, PATCH, DELETE /user
 
@@ -167,28 +174,26 @@ def query(data: dict, request):
     """
 
     if request.method == "GET":
-        return get_user_info(request)
+        return get_user_info(user)
 
     if request.method == "PATCH":
-        return edit_user_info(data, request)
+        return edit_user_info(data, request, user)
 
     if request.method == "DELETE":
-        return delete_user(request.user)
+        return delete_user(user)
 
 
-def get_user_info(request: HttpRequest):
+def get_user_info(user: User):
     """
     GET /user
 
     Get the user information for the current user. Returns the same struct as the login API.
     """
 
-    user: User = User.objects.get(auth_user=request.user)
-
     return user.to_detailed_struct()
 
 
-def edit_user_info(data: dict, request: HttpRequest):
+def edit_user_info(data: dict, request: HttpRequest, user: User):
     """
     PATCH /user
 
@@ -228,95 +233,112 @@ def edit_user_info(data: dict, request: HttpRequest):
     This API returns the user information (like login page) after the update.
     """
 
-    user: User = User.objects.get(auth_user=request.user)
-
     # Check password first
-    if "new_password" in data or "phone" in data or "email" in data:
+    if data.keys() & {"new_password", "phone", "email"}:
         if "old_password" not in data:
             raise FieldMissingError("old_password")
 
-        if not isinstance(data["old_password"], str):
+        old_password = data["old_password"]
+
+        if not isinstance(old_password, str):
             raise FieldTypeError("old_password")
 
-        if not user.auth_user.check_password(data["old_password"]):
+        if not user.auth_user.check_password(old_password):
             return 403, "Old password is incorrect"
 
+    new_password = data.get("new_password")
+    email = data.get("email")
+    phone = data.get("phone")
+    user_name = data.get("user_name")
+    avatar_url = data.get("avatar_url")
+
+    # Validate all fields before applying any of them
     if "new_password" in data:
-        User.validate_password(data.get("new_password"))
+        User.validate_password(new_password)
+    if "email" in data:
+        User.validate_email(email)
+    if "phone" in data:
+        User.validate_phone(phone)
+    if "user_name" in data:
+        User.validate_username(user_name)
+    if "avatar_url" in data:
+        User.validate_avatar_url(avatar_url)
 
-        user.auth_user.set_password(data["new_password"])
+    # Changed columns of the User and AuthUser rows, only these are written back
+    user_fields = []
+    auth_user_fields = []
 
-    if "email" in data:
-        User.validate_email(data.get("email"))
+    if "new_password" in data:
+        user.auth_user.set_password(new_password)
+        auth_user_fields.append("password")
 
-        user.email = data["email"]
+    if "email" in data:
+        user.email = email
+        user_fields.append("email")
 
     if "phone" in data:
-        User.validate_phone(data.get("phone"))
-
-        user.phone = data["phone"]
+        user.phone = phone
+        user_fields.append("phone")
 
     if "user_name" in data:
-        User.validate_username(data.get("user_name"))
-
-        user.auth_user.username = data["user_name"]
+        user.auth_user.username = user_name
+        auth_user_fields.append("username")
 
     if "avatar_url" in data:
-        User.validate_avatar_url(data.get("avatar_url"))
-
-        if data["avatar_url"] == "":
-            data["avatar_url"] = generate_random_avatar(user.auth_user.username)
+        if avatar_url == "":
+            avatar_url = generate_random_avatar(user.auth_user.username)
 
-        user.avatar_url = data["avatar_url"]
+        user.avatar_url = avatar_url
+        user_fields.append("avatar_url")
 
-    # Save data only if all checks have passed
-    user.save()
-    user.auth_user.save()
-    auth_login(request, user.auth_user)
-    request.session.save()
+    # Save data only if all checks have passed, in a single transaction
+    with transaction.atomic():
+        if user_fields:
+            user.save(update_fields=user_fields)
+        if auth_user_fields:
+            user.auth_user.save(update_fields=auth_user_fields)
+        # The session key is cycled here, the session itself is saved by the session middleware
+        auth_login(request, user.auth_user)
 
     # Notify user of profile change
-    from main.ws.notification import notify_profile_change
     notify_profile_change(user, request.session.session_key)
 
     return user.to_detailed_struct()
 
 
-def delete_user(auth_user: AuthUser):
+def delete_user(user: User):
     """
     Delete the user logged in and log him out.
     This API returns 200 status code with an empty data field if the deletion is successful.
     """
 
-    user: User = User.objects.get(auth_user=auth_user)
+    # Notifications are collected while the data still exists, and sent together after the deletion
+    sends = []
 
     # Notify all friends for user deletion
-    from main.ws.notification import notify_friend_to_be_deleted
-    for friend in Friend.objects.filter(user=user).union(Friend.objects.filter(friend=user)):
-        notify_friend_to_be_deleted(friend)
+    friends = Friend.objects.filter(Q(user=user) | Q(friend=user))
+    for friend in friends.select_related("user__auth_user", "friend"):
+        sends += friend_deletion_sends(friend)
 
     # Delete private chats (because private chats may not be owned by the user)
-    for relation in UserChatRelation.objects.filter(user=user, chat__name=""):
+    for relation in UserChatRelation.objects.filter(user=user, chat__name="").select_related("chat"):
         relation.chat.delete()
 
     # Notify owned chats to be deleted, from here on all chats should be group chats
-    from main.ws.notification import notify_chat_to_be_deleted
     for chat in Chat.objects.filter(owner=user):
-        notify_chat_to_be_deleted(chat)
+        sends += chat_deletion_sends(chat)
         chat.delete()
 
     # Notify all other chats for user leaving
-    from main.ws.notification import notify_chat_member_to_be_removed
-    for relation in UserChatRelation.objects.filter(user=user):
-        notify_chat_member_to_be_removed(relation.chat, user)
+    for relation in UserChatRelation.objects.filter(user=user).select_related("chat"):
+        sends += chat_member_removal_sends(relation.chat, user)
 
     # Delete friends
-    Friend.objects.filter(user=user).delete()
-    Friend.objects.filter(friend=user).delete()
+    friends.delete()
 
     # Notify user of logout
-    from main.ws.notification import notify_user_deletion
-    notify_user_deletion(user)
+    sends += user_deletion_sends(user)
+    group_send_all(sends)
 
     user.auth_user.delete()
     user.delete()
@@ -334,9 +356,9 @@ def get_user_info_by_id(_id: int):
     If the user with the given ID does not exist, the API returns 404 status code with an error message.
     """
 
-    try:
-        user = User.objects.get(id=_id)
-    except User.DoesNotExist:
+    # Read a plain row instead of creating model instances
+    row = User.objects.filter(id=_id).values(*User.basic_struct_fields()).first()
+    if row is None:
         return 404, "User not found"
 
-    return user.to_basic_struct()
+    return User.basic_struct_from_row(row)
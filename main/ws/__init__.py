@@ -47,17 +47,18 @@ Notification packets are actively sent to the client to notify the client of cer
 
 ## Details
 
-For detailed actions see the dispatch_action method in the MainWebsocketConsumer class;
+For detailed actions see the handlers in the action.py file;
 For detailed notification actions see the notification.py file.
 """
 
-import json
 from typing import Coroutine
 
+import orjson
 from channels.db import database_sync_to_async
 from channels.exceptions import DenyConnection
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 
+from main.cache import get_user_by_auth_user
 from main.models import User, AuthUser
 
 
@@ -90,15 +91,13 @@ class MainWebsocketConsumer(AsyncJsonWebsocketConsumer):
             await self.send_error("User is not authenticated", 0, 403)
             raise DenyConnection
 
-        self.user = await database_sync_to_async(User.objects.get)(auth_user=self.auth_user)
+        self.user = await database_sync_to_async(get_user_by_auth_user)(self.auth_user)
         self.session_key = self.scope["session"].session_key
 
-        from main.ws._notification_channels import setup_new_socket_channel
         await setup_new_socket_channel(self)
 
     async def disconnect(self, close_code: int) -> None:
         if self.user is not None:
-            from main.ws._notification_channels import discard_socket_channel
             await discard_socket_channel(self)
 
     async def dispatch(self, message):
@@ -112,41 +111,32 @@ class MainWebsocketConsumer(AsyncJsonWebsocketConsumer):
         if "type" in message:
             return await super().dispatch(message)
 
-        from main.ws._dispatcher import dispatch_notification
         await dispatch_notification(self, message)
 
+    @classmethod
+    async def encode_json(cls, content):
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS).decode()
+
     async def receive(self, text_data: str = None, bytes_data: bytes = None, **kwargs) -> None:
         """
-        Override the default receive method to avoid raising exceptions on binary data
+        Receive a packet, parse and validate its JSON content and dispatch the action to the corresponding method
+
+        Overrides the default receive method to avoid raising exceptions on binary data or invalid JSON,
+        the JSON is parsed here directly instead of through decode_json and receive_json.
         """
 
         if text_data is None:
             await self.send_error("Invalid packet", 0)
             return
 
-        await self.receive_json(await self.decode_json(text_data), **kwargs)
-
-    @classmethod
-    async def decode_json(cls, text_data):
-        """
-        Override the default JSON decoder to return None if the JSON is invalid (instead of raising an exception)
-        """
-
+        # Parse content
         try:
-            return json.loads(text_data)
-        except json.decoder.JSONDecodeError:
-            return None
-
-    async def receive_json(self, content: dict, **kwargs) -> None:
-        """
-        Receive JSON content, validate JSON content and dispatch the action to the corresponding method
-        """
-
-        # Validate content
-        if content is None:
+            content = orjson.loads(text_data)
+        except orjson.JSONDecodeError:
             await self.send_error("Malformed JSON content", 0)
             return
 
+        # Validate content
         if not isinstance(content, dict):
             await self.send_error("Invalid JSON content", 0)
             return
@@ -175,85 +165,19 @@ class MainWebsocketConsumer(AsyncJsonWebsocketConsumer):
 
     async def dispatch_action(self, action: str, data: any, req_id: int) -> None:
         """
-        Dispatch action to corresponding method
+        Dispatch action to corresponding handler, see ACTIONS in action.py for available actions
         """
 
-        if action == "ping":
-            """
-            Ping request, server will respond with pong. Mainly used for testing.
-
-            Unless the server is severely overloaded, the server will respond with a "pong" notification in no time.
-            """
-
-            await self.send_ok("pong", None, req_id)
-
-        elif action == "send_message":
-            """
-            Send a message to a chat
-
-            Expects data to be a dictionary in the following format: {
-                "chat_id": int,
-                "content": str,
-                [optional] "reply_to": int
-            }
-
-            chat_id: The chat id to send the message to
-            content: The message content
-            reply_to: Optional, the message id to reply to
+        handler = ACTIONS.get(action)
 
-            If the message is successfully sent, you will receive a "new message" notification (see notification.py)
-
-            You must be a member of the chat to send a message; the content must be a non-empty string.
-
-            If the reply_to field is set, the message will be a reply to the message with the specified id,
-            where the replied message must be in the same chat.
-
-            If any error condition is met, the server will send an "error" notification with the error message.
-
-            After the message is sent, all messages in this chat is marked as read automatically.
-            """
-
-            from main.ws.action import send_message
-            await send_message(self, data, req_id)
-
-        elif action == "recall_message":
-            """
-            Recall a sent message or delete a message.
-
-            Expects data to be a dictionary in the following format: {
-                "message_id": int,
-                "delete": true
-            }
-
-            If delete==true, the message will be deleted, only for the current user.
-
-            You will receive a "message deleted" notification if the message is deleted successfully;
-
-            Otherwise the message will be recalled.
-
-            You must be the sender to recall the message.
-
-            If the message is successfully recalled, you will receive a "message recalled" notification;
-            otherwise, an "error" notification will be sent.
-            """
-
-            from main.ws.action import recall_message
-            await recall_message(self, data, req_id)
-
-        elif action == "messages_read":
-            """
-            Mark all messages of a certain chat as read
-
-            Expects data to be a dictionary in the following format: {
-                "chat_id": int
-            }
+        if handler is None:
+            await self.send_error(f"Unknown action: {action}", req_id)
+            return
 
-            If the user is in the chat, all messages in the chat will be marked as read
-            and you will receive a "messages read" notification; otherwise, an error response will be sent.
-            """
+        await handler(self, data, req_id)
 
-            from main.ws.action import mark_chat_messages_read
-            await mark_chat_messages_read(self, data, req_id)
 
-        else:
-            await self.send_error(f"Unknown action: {action}", req_id)
+# Imported after the consumer class, which these modules depend on
+from main.ws.action import ACTIONS  # noqa: E402
+from main.ws._dispatcher import dispatch_notification  # noqa: E402
+from main.ws._notification_channels import setup_new_socket_channel, discard_socket_channel  # noqa: E402
@@ -11,7 +11,11 @@ async def dispatch_notification(self: MainWebsocketConsumer, message: dict) -> N
     """
 
     try:
-        await self.send_ok(message["action"], message["data"], 0)
+        if "text" in message:
+            # The notification is already encoded (see notification.encode_notification)
+            await self.send(text_data=message["text"])
+        else:
+            await self.send_ok(message["action"], message["data"], 0)
     except Exception as e:
         await self.send_error(f"Internal server error: {e}", 0, 500)
         return
@@ -6,43 +6,44 @@ Describes multiple channels that a user may subscribe to
 - Chat channel (chat_{chat_id}), used to notify chat members of group chat messages / admin info / etc
 - Session channel (session_{session_id}), used to notify user of session logout
 """
+import asyncio
+
 from channels.db import database_sync_to_async
 
-from main.models import UserChatRelation
+from main.models import User, UserChatRelation
 from main.ws import MainWebsocketConsumer
 
 
-async def setup_new_socket_channel(consumer: MainWebsocketConsumer) -> None:
+def _group_chat_ids(user: User) -> list[int]:
     """
-    Setup channels to listen to for a new websocket connection
+    IDs of the group chats of a user, private chats (with an empty name) have no chat channel
     """
 
-    user = consumer.user
-    await consumer.channel_layer.group_add(f"user_{user.id}", consumer.channel_name)
-    await consumer.channel_layer.group_add(f"session_{consumer.session_key}", consumer.channel_name)
+    return list(UserChatRelation.objects.filter(user=user).exclude(chat__name="").values_list("chat_id", flat=True))
 
-    relations = await database_sync_to_async(lambda: list(UserChatRelation.objects.filter(user=user)))()
 
-    for relation in relations:
-        if await database_sync_to_async(lambda r: r.chat.is_private())(relation):
-            continue
+async def _socket_groups(consumer: MainWebsocketConsumer) -> list[str]:
+    """
+    Groups a websocket connection listens to
+    """
 
-        await consumer.channel_layer.group_add(f"chat_{relation.chat.id}", consumer.channel_name)
+    chat_ids = await database_sync_to_async(_group_chat_ids)(consumer.user)
+    return [f"user_{consumer.user.id}", f"session_{consumer.session_key}", *(f"chat_{chat_id}" for chat_id in chat_ids)]
 
 
-async def discard_socket_channel(consumer: MainWebsocketConsumer) -> None:
+async def setup_new_socket_channel(consumer: MainWebsocketConsumer) -> None:
     """
-    Discard channels that the user was listening to
+    Setup channels to listen to for a new websocket connection
     """
 
-    user = consumer.user
-    await consumer.channel_layer.group_discard(f"user_{user.id}", consumer.channel_name)
-    await consumer.channel_layer.group_discard(f"session_{consumer.session_key}", consumer.channel_name)
+    groups = await _socket_groups(consumer)
+    await asyncio.gather(*(consumer.channel_layer.group_add(group, consumer.channel_name) for group in groups))
 
-    relations = await database_sync_to_async(lambda: list(UserChatRelation.objects.filter(user=user)))()
 
-    for relation in relations:
-        if await database_sync_to_async(lambda r: r.chat.is_private())(relation):
-            continue
+async def discard_socket_channel(consumer: MainWebsocketConsumer) -> None:
+    """
+    Discard channels that the user was listening to
+    """
 
-        await consumer.channel_layer.group_discard(f"chat_{relation.chat.id}", consumer.channel_name)
+    groups = await _socket_groups(consumer)
+    await asyncio.gather(*(consumer.channel_layer.group_discard(group, consumer.channel_name) for group in groups))
@@ -1,15 +1,46 @@
 import datetime
 
 from channels.db import database_sync_to_async
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 
 from main.models import User, Chat, ChatMessage, UserChatRelation
 from main.ws import MainWebsocketConsumer
+from main.ws.notification import group_send_all_async, new_message_sends, message_deleted_sends, \
+    message_recalled_sends, messages_read_sends
 
 
 class ParseError(Exception):
     pass
 
 
+async def ping(self: MainWebsocketConsumer, data: any, req_id: int):
+    """
+    Ping request, server will respond with pong. Mainly used for testing.
+
+    Unless the server is severely overloaded, the server will respond with a "pong" notification in no time.
+    """
+
+    await self.send_ok("pong", None, req_id)
+
+
+def _get_chat_and_reply_to(chat_id: int, user: User, reply_to_id: int | None) -> tuple:
+    """
+    Get the chat (annotated with whether the user is a member) and the replied message, in one sync call
+    """
+
+    chat: Chat | None = Chat.objects.filter(id=chat_id).only("id", "name").annotate(
+        is_member=Exists(Chat.members.through.objects.filter(chat_id=OuterRef("pk"), user_id=user.id)),
+    ).first()
+
+    reply_to: ChatMessage | None = None
+    if reply_to_id is not None:
+        reply_to = ChatMessage.objects.filter(id=reply_to_id, chat_id=chat_id) \
+            .select_related("sender__auth_user").first()
+
+    return chat, reply_to
+
+
 async def parse_message(data: dict, user: User, req_id: int, error_func) -> tuple:
     """
     Parse a message dict and return the message, chat, user and reply_to; throws if the message is invalid
@@ -27,13 +58,16 @@ async def parse_message(data: dict, user: User, req_id: int, error_func) -> tupl
 
     chat_id: int = data["chat_id"]
 
-    try:
-        chat: Chat = await database_sync_to_async(Chat.objects.get)(id=chat_id)
-    except Chat.DoesNotExist:
+    # The replied message is looked up together with the chat, restricted to the same chat
+    reply_to_id = data.get("reply_to")
+    chat, reply_to = await database_sync_to_async(_get_chat_and_reply_to)(
+        chat_id, user, reply_to_id if isinstance(reply_to_id, int) else None)
+
+    if chat is None:
         await error_func("Invalid chat_id", req_id)
         return False, None
 
-    if not await database_sync_to_async(lambda: user in chat.members.all())():
+    if not chat.is_member:
         await error_func("User is not a member of the chat", req_id)
         return False, None
 
@@ -48,30 +82,41 @@ async def parse_message(data: dict, user: User, req_id: int, error_func) -> tupl
         await error_func("Message cannot be empty", req_id)
         return False, None
 
-    # Validate reply_to and get ChatMessage
-    if "reply_to" not in data:
-        reply_to = None
-    else:
-        if not isinstance(data["reply_to"], int):
-            await error_func("Invalid reply_to", req_id)
-            return False, None
-
-        try:
-            reply_to = await database_sync_to_async(ChatMessage.objects.get)(id=data["reply_to"])
-        except ChatMessage.DoesNotExist:
+    # Validate reply_to
+    if "reply_to" in data:
+        if reply_to is None:
             await error_func("Invalid reply_to", req_id)
             return False, None
 
-        if not await database_sync_to_async(lambda: reply_to.chat == chat)():
-            await error_func("Invalid reply_to", req_id)
-            return False, None
+        reply_to.chat = chat
 
     return True, (message, chat, user, reply_to)
 
 
 async def send_message(self: MainWebsocketConsumer, data: dict, req_id: int):
     """
-    Send a message to a Chat
+    Send a message to a chat
+
+    Expects data to be a dictionary in the following format: {
+        "chat_id": int,
+        "content": str,
+        [optional] "reply_to": int
+    }
+
+    chat_id: The chat id to send the message to
+    content: The message content
+    reply_to: Optional, the message id to reply to
+
+    If the message is successfully sent, you will receive a "new message" notification (see notification.py)
+
+    You must be a member of the chat to send a message; the content must be a non-empty string.
+
+    If the reply_to field is set, the message will be a reply to the message with the specified id,
+    where the replied message must be in the same chat.
+
+    If any error condition is met, the server will send an "error" notification with the error message.
+
+    After the message is sent, all messages in this chat is marked as read automatically.
     """
 
     success, data = await parse_message(data, self.user, req_id, self.send_error)
@@ -79,18 +124,21 @@ async def send_message(self: MainWebsocketConsumer, data: dict, req_id: int):
     if not success:
         return
 
-    message, chat, user, reply_to = data
+    # Create message, notify chat members and mark messages in this chat as read
+    await group_send_all_async(await database_sync_to_async(sync_send_message)(*data))
 
-    # Create message
-    new_message = await (database_sync_to_async(ChatMessage.objects.create)
-                         (message=message, sender=user, chat=chat, reply_to=reply_to))
 
-    # Notify chat members
-    from main.ws.notification import notify_new_message
-    await database_sync_to_async(notify_new_message)(new_message)
+def sync_send_message(message: str, chat: Chat, user: User, reply_to: ChatMessage | None) -> list[tuple[str, dict]]:
+    """
+    Create a message and mark the chat as read by the sender in one transaction,
+    returns the new message and messages read notifications to send
+    """
+
+    with transaction.atomic():
+        new_message = ChatMessage.objects.create(message=message, sender=user, chat=chat, reply_to=reply_to)
+        sends = new_message_sends(new_message)
 
-    # Mark messages in this chat as read
-    await mark_chat_messages_read(self, {"chat_id": chat.id}, req_id)
+        return sends + sync_mark_chat_read(user, chat)
 
 
 def sync_mark_msg_recalled(message: ChatMessage):
@@ -98,16 +146,29 @@ def sync_mark_msg_recalled(message: ChatMessage):
     Mark a message as recalled
     """
 
-    message.deleted = True
-    message.message = "Message recalled"
-    message.sender = User.magic_user_deleted()
-    message.reply_to = None
-    message.save()
+    ChatMessage.objects.filter(id=message.id).update(deleted=True, message="Message recalled",
+                                                     sender=User.magic_user_deleted(), reply_to=None)
 
 
 async def recall_message(self: MainWebsocketConsumer, data: dict, req_id: int):
     """
-    Recall or delete a message from a Chat
+    Recall a sent message or delete a message.
+
+    Expects data to be a dictionary in the following format: {
+        "message_id": int,
+        "delete": true
+    }
+
+    If delete==true, the message will be deleted, only for the current user.
+
+    You will receive a "message deleted" notification if the message is deleted successfully;
+
+    Otherwise the message will be recalled.
+
+    You must be the sender to recall the message.
+
+    If the message is successfully recalled, you will receive a "message recalled" notification;
+    otherwise, an "error" notification will be sent.
     """
 
     # Validate data and get ChatMessage
@@ -117,7 +178,10 @@ async def recall_message(self: MainWebsocketConsumer, data: dict, req_id: int):
 
     message_id: int = data["message_id"]
     try:
-        message: ChatMessage = await database_sync_to_async(ChatMessage.objects.get)(id=message_id)
+        # Only the columns needed to check, recall and notify are loaded, not the message text
+        message: ChatMessage = await database_sync_to_async(
+            ChatMessage.objects.select_related("chat").only("id", "sender", "chat__id", "chat__name").get
+        )(id=message_id)
     except ChatMessage.DoesNotExist:
         await self.send_error("Invalid message to recall", req_id)
         return
@@ -127,11 +191,10 @@ async def recall_message(self: MainWebsocketConsumer, data: dict, req_id: int):
     if delete:
         await database_sync_to_async(lambda: message.deleted_users.add(self.user))()
 
-        from main.ws.notification import notify_message_deleted
-        await database_sync_to_async(notify_message_deleted)(message, self.user)
+        await group_send_all_async(message_deleted_sends(message, self.user))
         return
 
-    if not await database_sync_to_async(lambda: message.sender == self.user)():
+    if message.sender_id != self.user.id:
         await self.send_error("You are not the sender of the message", req_id)
         return
 
@@ -139,13 +202,38 @@ async def recall_message(self: MainWebsocketConsumer, data: dict, req_id: int):
     await database_sync_to_async(sync_mark_msg_recalled)(message)
 
     # Notify chat members
-    from main.ws.notification import notify_message_recalled
-    await database_sync_to_async(notify_message_recalled)(message)
+    await group_send_all_async(await database_sync_to_async(message_recalled_sends)(message))
+
+
+def sync_mark_chat_read(user: User, chat: Chat) -> list[tuple[str, dict]]:
+    """
+    Mark all messages in a chat as read by the user, returns the notification to send
+    """
+
+    # Insert read marks for the messages the user has not read yet, a mark inserted by a concurrent request is skipped
+    # by the unique constraint
+    through = ChatMessage.read_users.through
+    message_ids = ChatMessage.objects.filter(chat=chat).exclude(read_users=user).values_list("id", flat=True)
+
+    with transaction.atomic():
+        through.objects.bulk_create([through(chatmessage_id=message_id, user_id=user.id)
+                                     for message_id in message_ids], ignore_conflicts=True, batch_size=1000)
+
+        UserChatRelation.objects.filter(user=user, chat=chat).update(unread_after=datetime.datetime.now())
+
+    return messages_read_sends(user, chat)
 
 
 async def mark_chat_messages_read(self: MainWebsocketConsumer, data: dict, req_id: int):
     """
-    Mark all messages in a chat as read
+    Mark all messages of a certain chat as read
+
+    Expects data to be a dictionary in the following format: {
+        "chat_id": int
+    }
+
+    If the user is in the chat, all messages in the chat will be marked as read
+    and you will receive a "messages read" notification; otherwise, an error response will be sent.
     """
 
     # Validate data and get Chat
@@ -154,19 +242,18 @@ async def mark_chat_messages_read(self: MainWebsocketConsumer, data: dict, req_i
         return
 
     chat_id: int = data["chat_id"]
-    try:
-        chat: Chat = await database_sync_to_async(Chat.objects.get)(id=chat_id)
-    except Chat.DoesNotExist:
+    chat: Chat | None = await database_sync_to_async(Chat.objects.only("id", "name").filter(id=chat_id).first)()
+    if chat is None:
         await self.send_error("Invalid chat_id", req_id)
         return
 
-    def mark_msg_read_sync():
-        for msg in ChatMessage.objects.filter(chat=chat):
-            msg.read_users.add(self.user)
-
-        UserChatRelation.objects.filter(user=self.user, chat=chat).update(unread_after=datetime.datetime.now())
+    await group_send_all_async(await database_sync_to_async(sync_mark_chat_read)(self.user, chat))
 
-    await database_sync_to_async(mark_msg_read_sync)()
 
-    from main.ws.notification import notify_messages_read
-    await database_sync_to_async(notify_messages_read)(self.user, chat)
+# Action handlers by the "action" field of client packets, looked up by MainWebsocketConsumer.dispatch_action
+ACTIONS = {
+    "ping": ping,
+    "send_message": send_message,
+    "recall_message": recall_message,
+    "messages_read": mark_chat_messages_read,
+}
@@ -1,18 +1,87 @@
 """
 Defines multiple notifications that can be sent to users
 """
+import functools
+
+import orjson
+
 from asgiref.sync import async_to_sync
-from channels.layers import InMemoryChannelLayer
+from channels.layers import InMemoryChannelLayer, get_channel_layer
 
 from main.models import User, ChatMessage, Chat, ChatInvitation, Friend
 
 
-def get_channel_layer() -> InMemoryChannelLayer:
-    if not hasattr(get_channel_layer, "layer"):
-        from channels.layers import get_channel_layer as get_layer
-        get_channel_layer.layer = get_layer()
+# The default channel layer, looked up once
+_CHANNEL_LAYER: InMemoryChannelLayer = get_channel_layer()
+
+
+def group_send_all(sends: list[tuple[str, dict]]):
+    """
+    Send messages to multiple groups, crossing the sync-to-async boundary only once instead of once per group.
+
+    The *_sends functions below build the (group, message) pairs of a notification without sending them,
+    so that the notifications of a bulk operation can be collected and sent together.
+    """
+
+    if len(sends) == 0:
+        return
+
+    async_to_sync(group_send_all_async)(sends)
+
+
+async def group_send_all_async(sends: list[tuple[str, dict]]):
+    """
+    Send messages to multiple groups from async code, e.g. the websocket actions
+    """
+
+    for group, message in sends:
+        await _CHANNEL_LAYER.group_send(group, message)
+
+
+def encode_notification(action: str, data: any) -> str:
+    """
+    Encode a notification packet in the same format as MainWebsocketConsumer.send_ok.
+
+    Notifications carrying the encoded packet in the "text" field are forwarded to the client as is,
+    so that a payload sent to many sockets is serialized only once.
+    """
+
+    packet = {"action": action, "ok": True, "data": data, "request_id": 0}
+    return orjson.dumps(packet, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def _chat_groups(chat: Chat) -> list[str]:
+    """
+    Groups that receive the messages of a chat: the members' user channels for a private chat,
+    or the chat channel for a group chat
+    """
+
+    if chat.is_private():
+        return [f"user_{user_id}" for user_id in chat.members.values_list("id", flat=True)]
+
+    return [f"chat_{chat.id}"]
+
+
+def _group_chat_only(build_sends):
+    """
+    Decorate a *_sends function taking the chat as its first argument, so that it sends nothing for a private chat
+    """
+
+    @functools.wraps(build_sends)
+    def wrapper(chat: Chat, *args) -> list[tuple[str, dict]]:
+        if chat.is_private():
+            return []
+
+        return build_sends(chat, *args)
+
+    return wrapper
 
-    return get_channel_layer.layer
+
+def logout_sends(session_key: str) -> list[tuple[str, dict]]:
+    return [(f"session_{session_key}", {
+        "action": "logout",
+        "data": None,
+    })]
 
 
 def notify_logout(session_key: str):
@@ -20,11 +89,14 @@ def notify_logout(session_key: str):
     Notify user of logout
     """
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(f"session_{session_key}", {
+    group_send_all(logout_sends(session_key))
+
+
+def user_deletion_sends(user: User) -> list[tuple[str, dict]]:
+    return [(f"user_{user.id}", {
         "action": "logout",
         "data": None,
-    })
+    })]
 
 
 def notify_user_deletion(user: User):
@@ -32,11 +104,15 @@ def notify_user_deletion(user: User):
     Notify user of deletion, all open channels will be closed
     """
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(f"user_{user.id}", {
-        "action": "logout",
+    group_send_all(user_deletion_sends(user))
+
+
+def profile_change_sends(user: User, session_key: str) -> list[tuple[str, dict]]:
+    return [(f"user_{user.id}", {
+        "action": "profile_change",
         "data": None,
-    })
+        "session_key": session_key,
+    })]
 
 
 def notify_profile_change(user: User, session_key: str):
@@ -44,12 +120,17 @@ def notify_profile_change(user: User, session_key: str):
     Notify user of a profile change and notify open channels of the session key change
     """
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(f"user_{user.id}", {
-        "action": "profile_change",
-        "data": None,
-        "session_key": session_key,
-    })
+    group_send_all(profile_change_sends(user, session_key))
+
+
+@_group_chat_only
+def new_chat_sends(chat: Chat) -> list[tuple[str, dict]]:
+    # Chat channel is not yet created, so we must iterate over all members to notify them
+    return [(f"user_{user_id}", {
+        "action": "new_group_chat",
+        "data": {"chat_id": chat.id},
+        "chat_id": chat.id,
+    }) for user_id in chat.members.values_list("id", flat=True)]
 
 
 def notify_new_chat(chat: Chat):
@@ -59,18 +140,17 @@ def notify_new_chat(chat: Chat):
     Only effective for group chats
     """
 
-    if chat.is_private():
-        return
+    group_send_all(new_chat_sends(chat))
 
-    channel_layer = get_channel_layer()
 
-    # Chat channel is not yet created, so we must iterate over all members to notify them
-    for u in chat.members.all():
-        async_to_sync(channel_layer.group_send)(f"user_{u.id}", {
-            "action": "new_group_chat",
-            "data": {"chat_id": chat.id},
-            "chat_id": chat.id,
-        })
+def new_message_sends(message: ChatMessage) -> list[tuple[str, dict]]:
+    # Serialize the message once for all recipients
+    notification = {
+        "action": "new_message",
+        "text": encode_notification("new_message", {"message": message.to_detailed_struct(User.magic_user_system())}),
+    }
+
+    return [(group, notification) for group in _chat_groups(message.chat)]
 
 
 def notify_new_message(message: ChatMessage):
@@ -79,20 +159,14 @@ def notify_new_message(message: ChatMessage):
     while private messages are sent to the private chat channel
     """
 
-    chat = message.chat
-    channel_layer = get_channel_layer()
-    if chat.is_private():
-        for u in chat.members.all():
-            async_to_sync(channel_layer.group_send)(f"user_{u.id}", {
-                "action": "new_message",
-                "data": {"message": message.to_detailed_struct(User.magic_user_system())},
-            })
+    group_send_all(new_message_sends(message))
 
-    else:
-        async_to_sync(channel_layer.group_send)(f"chat_{chat.id}", {
-            "action": "new_message",
-            "data": {"message": message.to_detailed_struct(User.magic_user_system())},
-        })
+
+def message_recalled_sends(message: ChatMessage) -> list[tuple[str, dict]]:
+    return [(group, {
+        "action": "message_recalled",
+        "data": {"message_id": message.id},
+    }) for group in _chat_groups(message.chat)]
 
 
 def notify_message_recalled(message: ChatMessage):
@@ -100,20 +174,14 @@ def notify_message_recalled(message: ChatMessage):
     Notify chat members of a message recall
     """
 
-    chat = message.chat
-    channel_layer = get_channel_layer()
-    if chat.is_private():
-        for u in chat.members.all():
-            async_to_sync(channel_layer.group_send)(f"user_{u.id}", {
-                "action": "message_recalled",
-                "data": {"message_id": message.id},
-            })
+    group_send_all(message_recalled_sends(message))
+
 
-    else:
-        async_to_sync(channel_layer.group_send)(f"chat_{chat.id}", {
-            "action": "message_recalled",
-            "data": {"message_id": message.id},
-        })
+def message_deleted_sends(message: ChatMessage, user: User) -> list[tuple[str, dict]]:
+    return [(f"user_{user.id}", {
+        "action": "message_deleted",
+        "data": {"message_id": message.id},
+    })]
 
 
 def notify_message_deleted(message: ChatMessage, user: User):
@@ -121,11 +189,15 @@ def notify_message_deleted(message: ChatMessage, user: User):
     Notify the user of a deleted message
     """
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(f"user_{user.id}", {
-        "action": "message_deleted",
-        "data": {"message_id": message.id},
-    })
+    group_send_all(message_deleted_sends(message, user))
+
+
+@_group_chat_only
+def admin_state_change_sends(chat: Chat, user: User, is_admin: bool) -> list[tuple[str, dict]]:
+    return [(f"chat_{chat.id}", {
+        "action": "admin_state_change",
+        "data": {"chat_id": chat.id, "user_id": user.id, "is_admin": is_admin},
+    })]
 
 
 def notify_admin_state_change(chat: Chat, user: User, is_admin: bool):
@@ -133,14 +205,15 @@ def notify_admin_state_change(chat: Chat, user: User, is_admin: bool):
     Notify chat members of a change in admin status
     """
 
-    if chat.is_private():
-        return
+    group_send_all(admin_state_change_sends(chat, user, is_admin))
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(f"chat_{chat.id}", {
-        "action": "admin_state_change",
-        "data": {"chat_id": chat.id, "user_id": user.id, "is_admin": is_admin},
-    })
+
+@_group_chat_only
+def owner_state_change_sends(chat: Chat) -> list[tuple[str, dict]]:
+    return [(f"chat_{chat.id}", {
+        "action": "owner_state_change",
+        "data": {"chat_id": chat.id, "owner_id": chat.owner_id},
+    })]
 
 
 def notify_owner_state_change(chat: Chat):
@@ -148,14 +221,16 @@ def notify_owner_state_change(chat: Chat):
     Notify chat members of a change in owner status
     """
 
-    if chat.is_private():
-        return
+    group_send_all(owner_state_change_sends(chat))
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(f"chat_{chat.id}", {
-        "action": "owner_state_change",
-        "data": {"chat_id": chat.id, "owner_id": chat.owner.id},
-    })
+
+@_group_chat_only
+def chat_member_removal_sends(chat: Chat, member: User) -> list[tuple[str, dict]]:
+    return [(f"chat_{chat.id}", {
+        "action": "member_deleted",
+        "data": {"chat_id": chat.id, "user_id": member.id},
+        "chat_id": chat.id,
+    })]
 
 
 def notify_chat_member_to_be_removed(chat: Chat, member: User):
@@ -163,14 +238,24 @@ def notify_chat_member_to_be_removed(chat: Chat, member: User):
     Notify that a member is to be deleted from a chat
     """
 
-    if chat.is_private():
-        return
+    group_send_all(chat_member_removal_sends(chat, member))
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(f"chat_{chat.id}", {
-        "action": "member_deleted",
-        "data": {"chat_id": chat.id, "user_id": member.id},
-    })
+
+@_group_chat_only
+def chat_member_added_sends(chat: Chat, member: User) -> list[tuple[str, dict]]:
+    return [
+        # Notify the new user of the chat
+        (f"user_{member.id}", {
+            "action": "new_group_chat",
+            "data": {"chat_id": chat.id},
+            "chat_id": chat.id,
+        }),
+        # Then notify the chat members of the new member
+        (f"chat_{chat.id}", {
+            "action": "member_added",
+            "data": {"chat_id": chat.id, "user_id": member.id},
+        }),
+    ]
 
 
 def notify_chat_member_added(chat: Chat, member: User):
@@ -178,22 +263,7 @@ def notify_chat_member_added(chat: Chat, member: User):
     Notify that a member has been added to a chat
     """
 
-    if chat.is_private():
-        return
-
-    channel_layer = get_channel_layer()
-    # Notify the new user of the chat
-    async_to_sync(channel_layer.group_send)(f"user_{member.id}", {
-        "action": "new_group_chat",
-        "data": {"chat_id": chat.id},
-        "chat_id": chat.id,
-    })
-
-    # Then notify the chat members of the new member
-    async_to_sync(channel_layer.group_send)(f"chat_{chat.id}", {
-        "action": "member_added",
-        "data": {"chat_id": chat.id, "user_id": member.id},
-    })
+    group_send_all(chat_member_added_sends(chat, member))
 
 
 def notify_chat_member_invitation(invitation: ChatInvitation):
@@ -201,13 +271,22 @@ def notify_chat_member_invitation(invitation: ChatInvitation):
     Notify the chat owner and admins of a new chat invitation
     """
 
-    channel_layer = get_channel_layer()
-    users = list(invitation.chat.admins.all()) + [invitation.chat.owner]
-    for u in users:
-        async_to_sync(channel_layer.group_send)(f"user_{u.id}", {
-            "action": "chat_invitation",
-            "data": {"invitation": invitation.to_struct()},
-        })
+    # The invitation is serialized once for all recipients
+    notification = {
+        "action": "chat_invitation",
+        "text": encode_notification("chat_invitation", {"invitation": invitation.to_struct()}),
+    }
+    user_ids = list(invitation.chat.admins.values_list("id", flat=True)) + [invitation.chat.owner_id]
+    group_send_all([(f"user_{user_id}", notification) for user_id in user_ids])
+
+
+@_group_chat_only
+def chat_deletion_sends(chat: Chat) -> list[tuple[str, dict]]:
+    return [(f"chat_{chat.id}", {
+        "action": "chat_deleted",
+        "data": {"chat": chat.to_struct(User.magic_user_system())},
+        "chat_id": chat.id,
+    })]
 
 
 def notify_chat_to_be_deleted(chat: Chat):
@@ -215,15 +294,14 @@ def notify_chat_to_be_deleted(chat: Chat):
     Notify chat members that a chat is to be deleted
     """
 
-    if chat.is_private():
-        return
+    group_send_all(chat_deletion_sends(chat))
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(f"chat_{chat.id}", {
-        "action": "chat_deleted",
-        "data": {"chat": chat.to_struct(User.magic_user_system())},
-        "chat_id": chat.id,
-    })
+
+def friend_deletion_sends(friendship: Friend) -> list[tuple[str, dict]]:
+    return [(f"user_{friendship.friend.id}", {
+        "action": "friend_deleted",
+        "data": {"friend": friendship.user.to_detailed_struct()},
+    })]
 
 
 def notify_friend_to_be_deleted(friendship: Friend):
@@ -231,11 +309,20 @@ def notify_friend_to_be_deleted(friendship: Friend):
     Notify user that a friend is to be deleted, this is sent only to the opposite user
     """
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(f"user_{friendship.friend.id}", {
-        "action": "friend_deleted",
-        "data": {"friend": friendship.user.to_detailed_struct()},
-    })
+    group_send_all(friend_deletion_sends(friendship))
+
+
+def friend_created_sends(user: User, friend: User) -> list[tuple[str, dict]]:
+    return [
+        (f"user_{user.id}", {
+            "action": "friend_created",
+            "data": {"friend": friend.to_detailed_struct()},
+        }),
+        (f"user_{friend.id}", {
+            "action": "friend_created",
+            "data": {"friend": user.to_detailed_struct()},
+        }),
+    ]
 
 
 def notify_friend_created(user: User, friend: User):
@@ -243,15 +330,14 @@ def notify_friend_created(user: User, friend: User):
     Notify user that a user accepted a friend request
     """
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(f"user_{user.id}", {
-        "action": "friend_created",
-        "data": {"friend": friend.to_detailed_struct()},
-    })
-    async_to_sync(channel_layer.group_send)(f"user_{friend.id}", {
-        "action": "friend_created",
-        "data": {"friend": user.to_detailed_struct()},
-    })
+    group_send_all(friend_created_sends(user, friend))
+
+
+def messages_read_sends(user: User, chat: Chat) -> list[tuple[str, dict]]:
+    return [(group, {
+        "action": "messages_read",
+        "data": {"chat_id": chat.id, "user_id": user.id},
+    }) for group in _chat_groups(chat)]
 
 
 def notify_messages_read(user: User, chat: Chat):
@@ -259,16 +345,4 @@ def notify_messages_read(user: User, chat: Chat):
     Notify chat members that a user has read all messages
     """
 
-    channel_layer = get_channel_layer()
-    if chat.is_private():
-        for u in chat.members.all():
-            async_to_sync(channel_layer.group_send)(f"user_{u.id}", {
-                "action": "messages_read",
-                "data": {"chat_id": chat.id, "user_id": user.id},
-            })
-
-    else:
-        async_to_sync(channel_layer.group_send)(f"chat_{chat.id}", {
-            "action": "messages_read",
-            "data": {"chat_id": chat.id, "user_id": user.id},
-        })
+    group_send_all(messages_read_sends(user, chat))